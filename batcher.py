@@ -0,0 +1,229 @@
+# Collects decode requests from concurrent callers and steps all of their decoders together
+import queue
+import threading
+import time
+import numpy as np
+import metrics
+import sampling
+
+encode_seconds = metrics.Histogram('reina_encode_seconds', 'Encoder time per batch')
+step_seconds = metrics.Histogram('reina_decoder_step_seconds', 'Decoder time per step of a batch')
+sample_seconds = metrics.Histogram('reina_sample_seconds', 'Sampling time per token')
+queue_seconds = metrics.Histogram('reina_queue_wait_seconds', 'Time a request waits for its batch to start')
+batch_requests = metrics.Histogram('reina_batch_requests', 'Requests decoded together', (1, 2, 4, 8, 16, 32, 64))
+reply_tokens = metrics.Histogram('reina_reply_tokens', 'Tokens per reply', (1, 2, 4, 8, 12, 16, 20, 25, 30, 40, 50))
+
+class DecodeRequest(object):
+    def __init__(self, input_seq, sampler, stream=False, initial_state=None):
+        self.input_seq = input_seq
+        self.sampler = sampler
+        # [h, c] the encoder starts from, state is the decoder's [h, c] once the reply is done
+        self.initial_state = initial_state
+        self.state = None
+        self.tokens = []
+        self.error = None
+        self.created = time.perf_counter()
+        self.done = threading.Event()
+        # Streaming callers get every token as soon as it is sampled, None marks the end
+        self.stream = queue.Queue() if stream else None
+
+    def add_token(self, token):
+        self.tokens.append(token)
+        if self.stream is not None:
+            self.stream.put(token)
+
+    def finish(self, error=None):
+        self.error = error
+        if error is None:
+            reply_tokens.observe(len(self.tokens))
+        self.done.set()
+        if self.stream is not None:
+            self.stream.put(None)
+
+    def result(self):
+        # Blocks until the sequence is finished, returns the sampled token ids
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.tokens
+
+    def stream_tokens(self):
+        # Yields token ids while the batch is still running
+        while True:
+            token = self.stream.get()
+            if token is None:
+                break
+            yield token
+        if self.error is not None:
+            raise self.error
+
+class DecodeBatcher(object):
+    # encode(input_seqs, initial_state=None) -> [h, c] and step(target_seq, h, c) -> (probabilities, h, c)
+    # both work on whole batches, sampler is the sampling.Sampler used when a request brings none
+    # encode only gets an initial_state when a request in the batch carries one
+    def __init__(self, encode, step, sampler, go_index, eos_index, max_len, window=0.01, max_batch_size=16):
+        self.encode = encode
+        self.step = step
+        self.sampler = sampler
+        self.go_index = go_index
+        self.eos_index = eos_index
+        self.max_len = max_len
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self.requests = queue.Queue()
+        self.between_batches = queue.Queue()
+        self.thread = threading.Thread(target=self._run, name='decode-batcher')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, input_seq, sampler=None, stream=False, initial_state=None):
+        request = DecodeRequest(input_seq, sampler or self.sampler, stream, initial_state)
+        self.requests.put(request)
+        return request
+
+    def submit_many(self, input_seqs, samplers):
+        # One request per row of input_seqs, all of them go into the same batch whatever max_batch_size is
+        requests = [DecodeRequest(input_seqs[i:i+1], samplers[i] or self.sampler) for i in range(len(input_seqs))]
+        if len(requests) > 0:
+            self.requests.put(requests)
+        return requests
+
+    def decode(self, input_seq, sampler=None):
+        # Blocks the caller until its sequence is finished, returns the sampled token ids
+        return self.submit(input_seq, sampler).result()
+
+    def decode_iter(self, input_seq, sampler=None):
+        # Generator version of decode(), yields token ids while the batch is still running
+        return self.submit(input_seq, sampler, stream=True).stream_tokens()
+
+    def call_between_batches(self, fn):
+        # fn runs on the batcher thread once the running batch is done, so no
+        # sequence ever sees two sets of weights
+        self.between_batches.put(fn)
+        # Wakes the thread up in case it is idle
+        self.requests.put(None)
+
+    def _collect(self):
+        first = self.requests.get()
+        if first is None:
+            return []
+        if isinstance(first, list):
+            return first
+        batch = [first]
+        deadline = time.time() + self.window
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                request = self.requests.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if isinstance(request, list):
+                # A bulk group joins the waiting requests and closes the batch
+                batch += request
+                break
+            if request is not None:
+                batch.append(request)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            while not self.between_batches.empty():
+                fn = self.between_batches.get()
+                try:
+                    fn()
+                except Exception as e:
+                    print("Could not run", fn, e)
+            if len(batch) == 0:
+                continue
+            try:
+                self._decode_batch(batch)
+            except Exception as e:
+                for request in batch:
+                    if not request.done.is_set():
+                        request.finish(e)
+
+    def _encode(self, input_seqs, initial_state=None):
+        start = time.perf_counter()
+        if initial_state is None:
+            states = self.encode(input_seqs)
+        else:
+            states = self.encode(input_seqs, initial_state)
+        encode_seconds.observe(time.perf_counter() - start)
+        return states
+
+    def _step(self, target_seq, h, c):
+        start = time.perf_counter()
+        result = self.step(target_seq, h, c)
+        step_seconds.observe(time.perf_counter() - start)
+        return result
+
+    def _decode_batch(self, batch):
+        started = time.perf_counter()
+        for request in batch:
+            queue_seconds.observe(started - request.created)
+        batch_requests.observe(len(batch))
+
+        # Beam search keeps several hypotheses per request so it runs on its own
+        # A failing request only fails itself, never the others of the batch
+        for request in [r for r in batch if r.sampler.strategy == 'beam']:
+            try:
+                tokens, request.state = sampling.beam_search(
+                    lambda input_seqs: self._encode(input_seqs, request.initial_state), self._step,
+                    request.input_seq, self.go_index, self.eos_index,
+                    self.max_len, request.sampler.beam_width, return_state=True)
+            except Exception as e:
+                request.finish(e)
+                continue
+            for token in tokens:
+                request.add_token(token)
+            request.finish()
+        batch = [r for r in batch if r.sampler.strategy != 'beam']
+        if len(batch) == 0:
+            return
+
+        width = max(r.input_seq.shape[1] for r in batch)
+        input_seqs = np.zeros((len(batch), width), dtype='int32')
+        for i, request in enumerate(batch):
+            input_seqs[i, :request.input_seq.shape[1]] = request.input_seq[0]
+
+        initial_state = None
+        if any(r.initial_state is not None for r in batch):
+            # Requests without a state start from zeros like a plain encode
+            latent_dim = next(r.initial_state for r in batch if r.initial_state is not None)[0].shape[-1]
+            initial_state = [np.zeros((len(batch), latent_dim), dtype='float32') for _ in range(2)]
+            for i, request in enumerate(batch):
+                if request.initial_state is not None:
+                    initial_state[0][i] = request.initial_state[0][0]
+                    initial_state[1][i] = request.initial_state[1][0]
+        h, c = self._encode(input_seqs, initial_state)
+        target_seq = np.full((len(batch), 1), self.go_index, dtype='int32')
+        active = list(batch)
+        while len(active) > 0:
+            output_tokens, h, c = self._step(target_seq, h, c)
+
+            keep = []
+            for row, request in enumerate(active):
+                start = time.perf_counter()
+                try:
+                    sampled_token_index = int(request.sampler(output_tokens[row:row+1])[0])
+                except Exception as e:
+                    request.finish(e)
+                    continue
+                sample_seconds.observe(time.perf_counter() - start)
+                request.add_token(sampled_token_index)
+                target_seq[row, 0] = sampled_token_index
+                if sampled_token_index == self.eos_index or len(request.tokens) >= self.max_len:
+                    request.state = [h[row:row+1].copy(), c[row:row+1].copy()]
+                    request.finish()
+                else:
+                    keep.append(row)
+
+            # Finished sequences leave the batch so later steps only run the ones still going
+            if len(keep) < len(active):
+                active = [active[row] for row in keep]
+                target_seq = target_seq[keep]
+                h = h[keep]
+                c = c[keep]
@@ -0,0 +1,74 @@
+# Times vocab_builder against the old quadratic grouping on synthetic vocabularies
+# Usage: python bench_vocab.py [vocab sizes...] [--legacy-max N] [--tag]
+from __future__ import print_function
+import operator
+import random
+import shutil
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+import cli
+import vocab_builder
+
+tags = ['CC', 'CD', 'DT', 'IN', 'JJ', 'NN', 'NNP', 'NNS', 'PRP', 'RB', 'VB', 'VBD', 'VBG', 'VBN', 'VBP', 'VBZ', '.']
+
+def legacy_group(dict_words, tagged):
+    # The grouping build_vocab used before, kept to check the output order
+    words_tagged = {}
+    for w, tag in tagged:
+        for regex in vocab_builder.special_tokens:
+            if vocab_builder.re.match(regex, w): tag = ".SPCL"
+        if w.lower() in vocab_builder.special_words:
+            tag = "SLANG"
+        if tag in list(words_tagged.keys()):
+            words_tagged[tag] += " " + w
+        else:
+            words_tagged[tag] = w
+    vocab = []
+    for tag in sorted(list(words_tagged.keys())):
+        w = words_tagged[tag].split(" ")
+        tagged_word_in_dict = {x: freq for x, freq in dict_words.items() if x in w}
+        vocab += OrderedDict(sorted(tagged_word_in_dict.items(), key=operator.itemgetter(1), reverse=True)).keys()
+    return vocab
+
+def synthetic_vocab(size, rng):
+    words = dict([("<UNK>", 0), ("<GO>", 0), ("<EOS>", 0), ("lol", 0), ("$help", 0)])
+    while len(words) < size:
+        w = "w%d" % len(words)
+        # Zipf-like counts so plenty of words share a frequency
+        words[w] = int(1000 / (1 + rng.randrange(size)) ** 0.5)
+    return words
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return (result, time.perf_counter() - start)
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    legacy_max = int(cli.option(args, '--legacy-max', 10000))
+    use_tagger = cli.flag(args, '--tag')
+    sizes = [int(a) for a in args] or [10000, 50000, 200000]
+
+    rng = random.Random(0)
+    for size in sizes:
+        dict_words = synthetic_vocab(size, rng)
+        tagged = [(w, rng.choice(tags)) for w in dict_words]
+
+        vocab, new_time = timed(vocab_builder.group_by_tag, dict_words, tagged)
+        line = "%7d words  group_by_tag %.3fs" % (size, new_time)
+        if size <= legacy_max:
+            legacy, legacy_time = timed(legacy_group, dict_words, tagged)
+            assert legacy == vocab, "output order differs from the old build_vocab"
+            line += "  legacy %.3fs (x%.0f)" % (legacy_time, legacy_time / max(new_time, 1e-9))
+        if use_tagger:
+            # First call tags everything into an empty cache, the second one only reads it
+            cache = tempfile.mkdtemp()
+            try:
+                _, cold = timed(vocab_builder.build_vocab, dict_words, None, cache)
+                _, warm = timed(vocab_builder.build_vocab, dict_words, None, cache)
+            finally:
+                shutil.rmtree(cache)
+            line += "  build_vocab cold %.3fs warm %.3fs" % (cold, warm)
+        print(line)
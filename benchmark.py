@@ -0,0 +1,243 @@
+# Times every stage of the pipeline on its own and writes the results as JSON
+# Usage: python benchmark.py [--pairs N] [--corpus file,...] [--stages name,...] [--output results.json]
+#        python benchmark.py compare <old results.json> <new results.json> [--threshold 0.1]
+# Stages: tokenize, build_vocab, vectorize, train_step, train_step_sampled, sentence_to_seq, decode
+# The corpus is synthetic unless --corpus names +++$+++ files. train_step needs Keras,
+# sentence_to_seq and decode load the serving bundle from config.ini through serving.py
+from __future__ import print_function
+from io import StringIO
+import contextlib
+import json
+import platform
+import resource
+import sys
+import time
+import numpy as np
+import cli
+import corpus
+import vocab_builder
+
+stages = ['tokenize', 'build_vocab', 'vectorize', 'train_step', 'train_step_sampled', 'sentence_to_seq', 'decode']
+
+batch_size = 64
+max_seq_len = 20
+vocab_size = 5000
+# Small model so train_step measures the framework overhead as much as the maths
+latent_dim = 64
+decode_replies = 50
+# Words sampled besides the target by train_step_sampled
+num_sampled = 256
+
+def synthetic_pairs(n, rng, words=20000):
+    # Zipf-like word choice so the vocab has a long tail like real chat logs
+    vocab = ["w%d" % i for i in range(words)]
+    weights = 1. / np.arange(1, words + 1)
+    weights /= weights.sum()
+    pairs = []
+    for _ in range(n):
+        lengths = rng.randint(1, max_seq_len, size=2)
+        pairs.append(tuple(" ".join(rng.choice(vocab, size=l, p=weights)) + rng.choice([" .", " ?", " !"]) for l in lengths))
+    return pairs
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes everywhere else
+    return peak / (1024. * 1024.) if sys.platform == 'darwin' else peak / 1024.
+
+def summarize(latencies, items, unit):
+    latencies = np.asarray(latencies, dtype='float64')
+    seconds = float(latencies.sum())
+    p50, p95, p99 = np.percentile(latencies * 1000, [50, 95, 99]) if len(latencies) else (0., 0., 0.)
+    return {
+        'unit': unit,
+        'items': items,
+        'seconds': seconds,
+        'throughput': items / seconds if seconds > 0 else 0.,
+        'p50_ms': float(p50),
+        'p95_ms': float(p95),
+        'p99_ms': float(p99),
+        'peak_rss_mb': peak_rss_mb()
+    }
+
+def timed_each(fn, args):
+    latencies = []
+    results = []
+    for a in args:
+        start = time.perf_counter()
+        results.append(fn(a))
+        latencies.append(time.perf_counter() - start)
+    return (results, latencies)
+
+def batches_of(items, size):
+    return [items[i:i+size] for i in range(0, len(items), size)]
+
+def bench_tokenize(state):
+    texts = [corpus.prepare_pair(a, b, max_seq_len) for a, b in state['pairs']]
+    lines = [t for pair in texts for t in pair]
+    tokens, latencies = timed_each(corpus.tokenizer.tokenize, lines)
+    state['input_tokens'] = tokens[0::2]
+    state['target_tokens'] = tokens[1::2]
+    return summarize(latencies, len(lines), 'lines')
+
+def bench_build_vocab(state):
+    input_words = dict([("<UNK>", 0)])
+    target_words = dict([("<GO>", 0), ("<UNK>", 0), ("<EOS>", 0)])
+    for tokens in state['input_tokens']:
+        corpus.count_words(input_words, tokens, vocab_size)
+    for tokens in state['target_tokens']:
+        corpus.count_words(target_words, tokens, vocab_size)
+    # Any order does for the later stages, so they still run when the tagger data is missing
+    vocabs = [["<PAD>"] + list(words) for words in (input_words, target_words)]
+    state['input_token_index'] = dict((w, i) for i, w in enumerate(vocabs[0]))
+    state['target_token_index'] = dict((w, i) for i, w in enumerate(vocabs[1]))
+    # Without the tag cache every call runs nltk.pos_tag like a first run of bot.py
+    try:
+        vocabs, latencies = timed_each(lambda words: ["<PAD>"] + vocab_builder.build_vocab(words, None, None),
+                                       (input_words, target_words))
+    except LookupError:
+        raise LookupError("no NLTK POS tagger data, see nltk.download()")
+    state['input_token_index'] = dict((w, i) for i, w in enumerate(vocabs[0]))
+    state['target_token_index'] = dict((w, i) for i, w in enumerate(vocabs[1]))
+    return summarize(latencies, len(input_words) + len(target_words), 'words')
+
+def bench_vectorize(state):
+    max_encoder = max(len(t) for t in state['input_tokens'])
+    max_decoder = max(len(t) for t in state['target_tokens'])
+    pairs = list(zip(state['input_tokens'], state['target_tokens']))
+
+    def vectorize(batch):
+        return (corpus.vectorize_tokens([p[0] for p in batch], state['input_token_index'], max_encoder),
+                corpus.vectorize_tokens([p[1] for p in batch], state['target_token_index'], max_decoder))
+    state['batches'], latencies = timed_each(vectorize, batches_of(pairs, batch_size))
+    return summarize(latencies, len(pairs), 'pairs')
+
+def bench_train_step(state, sampled=0):
+    import seq2seq
+    model = seq2seq.build_models(
+        len(state['input_token_index']), len(state['target_token_index']), latent_dim, latent_dim, sampled)[0]
+
+    def step(batch):
+        encoder_input_data, decoder_input_data = batch
+        decoder_target_data = np.expand_dims(corpus.shift_targets(decoder_input_data), -1)
+        return model.train_on_batch([encoder_input_data, decoder_input_data], decoder_target_data)
+    # The first batch builds the training function, it is not counted
+    step(state['batches'][0])
+    _, latencies = timed_each(step, state['batches'])
+    return summarize(latencies, sum(len(b[0]) for b in state['batches']), 'pairs')
+
+def bench_train_step_sampled(state):
+    return bench_train_step(state, num_sampled)
+
+def bench_sentence_to_seq(state):
+    import serving
+    sentences = [a for a, _ in state['pairs']]
+    with contextlib.redirect_stdout(StringIO()):
+        results, latencies = timed_each(serving.sentence_to_seq, sentences)
+    state['seqs'] = [seq for seq, _ in results]
+    return summarize(latencies, len(sentences), 'sentences')
+
+def bench_decode(state):
+    # One request at a time, so this is the latency a lone user sees including the batch window
+    import serving
+    import sampling
+    seqs = state.get('seqs') or [np.zeros((1, max_seq_len), dtype='int32')]
+    reply_latencies = []
+    token_latencies = []
+    for seq in seqs[:decode_replies]:
+        start = last = time.perf_counter()
+        for _ in serving.decode_sequence_iter(seq, sampling.Sampler('greedy')):
+            now = time.perf_counter()
+            token_latencies.append(now - last)
+            last = now
+        reply_latencies.append(time.perf_counter() - start)
+    result = summarize(reply_latencies, len(reply_latencies), 'replies')
+    per_token = summarize(token_latencies, len(token_latencies), 'tokens')
+    for key in ('throughput', 'p50_ms', 'p95_ms', 'p99_ms'):
+        result['token_' + key] = per_token[key]
+    return result
+
+def run(pairs, selected):
+    state = {'pairs': pairs}
+    results = {}
+    # Later stages need what the earlier ones produced
+    needed = set(selected)
+    if needed & set(['build_vocab', 'vectorize', 'train_step', 'train_step_sampled']):
+        needed.add('tokenize')
+    if needed & set(['vectorize', 'train_step', 'train_step_sampled']):
+        needed.add('build_vocab')
+    if needed & set(['train_step', 'train_step_sampled']):
+        needed.add('vectorize')
+    for stage in stages:
+        if stage not in needed:
+            continue
+        try:
+            result = globals()['bench_' + stage](state)
+        # Keras missing, no NLTK tagger data for build_vocab or no trained bundle for the serving stages
+        except (ImportError, LookupError, OSError) as e:
+            print("%-18s skipped: %s" % (stage, e))
+            continue
+        if stage in selected:
+            results[stage] = result
+            print("%-18s %10.1f %s/s  p50 %8.3fms  p95 %8.3fms  p99 %8.3fms  peak rss %.0fMB" % (
+                stage, result['throughput'], result['unit'], result['p50_ms'], result['p95_ms'],
+                result['p99_ms'], result['peak_rss_mb']))
+    return results
+
+def compare(old, new, threshold=0.1):
+    # A stage regresses when its throughput drops or its p95 grows by more than threshold
+    regressions = []
+    for stage in stages:
+        if stage not in old['stages'] or stage not in new['stages']:
+            continue
+        a = old['stages'][stage]
+        b = new['stages'][stage]
+        throughput = b['throughput'] / a['throughput'] - 1 if a['throughput'] else 0.
+        p95 = b['p95_ms'] / a['p95_ms'] - 1 if a['p95_ms'] else 0.
+        flag = throughput < -threshold or p95 > threshold
+        if flag:
+            regressions.append(stage)
+        print("%-18s throughput %+6.1f%%  p95 %+6.1f%%%s" % (
+            stage, throughput * 100, p95 * 100, "  REGRESSION" if flag else ""))
+    return regressions
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if len(args) > 0 and args[0] == 'compare':
+        threshold = float(cli.option(args, '--threshold', 0.1))
+        with open(args[1]) as f:
+            old = json.load(f)
+        with open(args[2]) as f:
+            new = json.load(f)
+        sys.exit(1 if compare(old, new, threshold) else 0)
+
+    num_pairs = int(cli.option(args, '--pairs', 5000))
+    corpus_files = cli.option(args, '--corpus', None)
+    selected = cli.option(args, '--stages', ",".join(stages)).split(',')
+    output = cli.option(args, '--output', None)
+    for stage in selected:
+        if stage not in stages:
+            sys.exit("Unknown stage: %s" % stage)
+
+    if corpus_files:
+        pairs = list(corpus.read_pairs(corpus_files.split(','), num_pairs))
+    else:
+        pairs = synthetic_pairs(num_pairs, np.random.RandomState(0))
+    print("%d pairs from %s" % (len(pairs), corpus_files or "synthetic corpus"))
+
+    results = {
+        'created': time.time(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'settings': {
+            'pairs': len(pairs),
+            'corpus': corpus_files or 'synthetic',
+            'batch_size': batch_size,
+            'max_seq_len': max_seq_len,
+            'vocab_size': vocab_size,
+            'latent_dim': latent_dim
+        },
+        'stages': run(pairs, selected)
+    }
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=1)
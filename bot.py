@@ -1,23 +1,28 @@
 from __future__ import print_function
-from io import open
 import os
 import os.path
 import configparser
 import operator
 from collections import OrderedDict
 import nltk
-from nltk.tokenize import RegexpTokenizer
+import bundle
+import checkpoints
+import corpus
+import data_generator
+import numpy_lstm
+import sampling
+import seq2seq
+import shortlist
+import token_corpus
+import vocabulary
 import vocab_builder
 import random
 import numpy as np
-from keras.models import Model
-from keras.layers import Input, LSTM, Dense
-from keras.callbacks import ModelCheckpoint
 
 ### CONSTANTS
 here = os.path.dirname(__file__)
 
-tokenizer = RegexpTokenizer(r'\w+|\<[A-Z]+\>|\$[a-z]+|&[a-z]+;|[a-z]?\'[a-z]+|[.?!]') # Special commands are: $command
+tokenizer = corpus.tokenizer
 blacklist_pattern = r'http://[a-z]*'
 
 config = configparser.ConfigParser()
@@ -27,6 +32,7 @@ config.read(conf_file)
 batch_size = int(config['DEFAULT']['batch_size'])
 epochs = int(config['DEFAULT']['epochs'])
 latent_dim = int(config['DEFAULT']['latent_dim'])
+embedding_dim = int(config['DEFAULT'].get('embedding_dim', latent_dim))
 num_samples = int(config['DEFAULT']['num_samples'])
 
 data_path = config['DEFAULT']['data_path']
@@ -34,69 +40,71 @@ training_data = config['DEFAULT']['data'].split(',')
 vocab_size = int(config['DEFAULT']['vocab_size'])
 
 max_seq_len = int(config['DEFAULT']['max_seq_len'])
-input_texts = []
-target_texts = []
-input_words = dict([("<UNK>", 0)])
-target_words = dict([("<GO>", 0), ("<UNK>", 0), ("<EOS>", 0)])
-
-line_enc = []
-line_dec = []
-
-for file_name in training_data:
-    with open(os.path.join(here, data_path + file_name), 'r', encoding='utf-8', errors='ignore') as f:
-        line = f.readline()
-        while line != '' and len(line_enc) < num_samples:
-            data = line.split('+++$+++')
-            line_enc.append(data[0])
-            line_dec.append(data[1])
-            line = f.readline()
-
-small_samp_size = min([num_samples, len(line_enc)-1, len(line_dec)-1])
-if len(line_enc) > num_samples or len(line_dec) > num_samples:
-    line_enc = line_enc[:small_samp_size]
-    line_dec = line_dec[:small_samp_size]
-
-for i in range(small_samp_size):
-    input_text = line_enc[i].lower()
-    target_text = "<GO> " + line_dec[i] + " <EOS>"
-    
-    # print(tokenizer.tokenize(input_text))
-    if len(input_text.split(' ')) > max_seq_len:
-        input_text = " ".join(input_text.split(' ')[:max_seq_len])
-    if len(target_text.split(' ')) > max_seq_len:
-        target_text = " ".join(target_text.split(' ')[:max_seq_len-1]) + " <EOS>"
-
-    for w in tokenizer.tokenize(input_text):
-        if w not in input_words:
-            if len(input_words) < vocab_size:
-                input_words.update({w: 1})
-            else:
-                input_text.replace(w, "<UNK>")
-                w="<UNK>"
-        else:
-            input_words[w] += 1
-    for w in tokenizer.tokenize(target_text):
-        if w not in target_words:
-            if len(target_words) < vocab_size:
-                target_words.update({w: 1})
-            else:
-                target_text.replace(w, "<UNK>")
-                w="<UNK>"
-        else:
-            target_words[w] += 1
-
-    input_texts.append(input_text)
-    target_texts.append(target_text)
-
-input_words = vocab_builder.build_vocab(input_words, data_path + 'in.vocab')
-target_words = vocab_builder.build_vocab(target_words, data_path + 'tg.vocab')
+# Streaming reads the batches from disk during training instead of keeping every tensor in memory
+streaming = config['DEFAULT'].getboolean('streaming', False)
+workers = int(config['DEFAULT'].get('workers', 1))
+# Processes tokenizing and vectorizing the corpus when it is not streamed
+preprocess_workers = int(config['DEFAULT'].get('preprocess_workers', os.cpu_count() or 1))
+validation_split = 0.05
+bundle_file = config['DEFAULT'].get('bundle', 'model/bundle.json')
+# Directory of the memory mapped token id corpus (see token_corpus.py), written on the first run
+# and read by every run after that as long as the corpus settings and files stay the same
+binary_corpus = config['DEFAULT'].get('binary_corpus', '')
+# Index of the saved checkpoints, verify_checkpoints checks the file hash before loading one
+manifest_file = os.path.join(here, config['DEFAULT'].get('checkpoint_manifest', 'model/checkpoints.json'))
+verify_checkpoints = config['DEFAULT'].getboolean('verify_checkpoints', False)
+# Length boundaries of the training buckets, every batch is padded to its own longest pair
+bucket_boundaries = [int(b) for b in config['DEFAULT'].get('buckets', '').split(',') if b.strip()]
+# Number of words the softmax samples besides the target while training, 0 trains on the full softmax
+sampled_softmax = int(config['DEFAULT'].get('sampled_softmax', 0))
+# The decode-time shortlist of the numpy backend (see shortlist.py)
+use_shortlist = config['DEFAULT'].getboolean('shortlist', False)
+
+training_files = [os.path.join(here, data_path + file_name) for file_name in training_data]
+# first trains on the first num_samples pairs, reservoir on num_samples pairs drawn from all of the
+# files by their data_weights (one per file) with data_seed
+data_sampling, data_weights, data_seed = corpus.sampling_settings(config['DEFAULT'])
+binary_corpus_path = os.path.join(here, binary_corpus) if binary_corpus else None
+corpus_hash = bundle.config_hash(config['DEFAULT'], bundle.corpus_keys)
+from_binary = binary_corpus_path is not None and token_corpus.is_current(binary_corpus_path, corpus_hash, training_files)
+if len(bucket_boundaries) > 0 and streaming and binary_corpus_path is None:
+    print("Bucketing needs binary_corpus when streaming, training without buckets")
+    bucket_boundaries = []
+# Training batches come from a Sequence rather than from tensors held in memory
+sequences = streaming or binary_corpus_path is not None or len(bucket_boundaries) > 0
+
+if from_binary:
+    token_data = token_corpus.TokenCorpus(binary_corpus_path)
+    samples = len(token_data)
+    max_encoder_seq_length = token_data.max_encoder_seq_length
+    max_decoder_seq_length = token_data.max_decoder_seq_length
+    input_words = token_data.header['input_vocab']
+    target_words = token_data.header['target_vocab']
+elif streaming:
+    (batches, samples, input_words, target_words,
+        max_encoder_seq_length, max_decoder_seq_length) = data_generator.scan_corpus(
+        training_files, batch_size, max_seq_len, vocab_size, num_samples, data_sampling, data_weights, data_seed)
+else:
+    input_words = OrderedDict([("<UNK>", 0)])
+    target_words = OrderedDict([("<GO>", 0), ("<UNK>", 0), ("<EOS>", 0)])
+
+    # Every line is tokenized once, the tokens are kept for vectorizing
+    input_tokens, target_tokens = corpus.tokenize_corpus(
+        corpus.training_pairs(training_files, num_samples, data_sampling, data_weights, data_seed), max_seq_len,
+        input_words, target_words, vocab_size, preprocess_workers)
+
+    samples = len(input_tokens)
+    max_encoder_seq_length = max([len(tokens) for tokens in input_tokens])
+    max_decoder_seq_length = max([len(tokens) for tokens in target_tokens])
+
+if not from_binary:
+    # Id 0 is reserved for padding so the embedding layers can mask it out
+    input_words = ["<PAD>"] + vocab_builder.build_vocab(input_words, data_path + 'in.vocab')
+    target_words = ["<PAD>"] + vocab_builder.build_vocab(target_words, data_path + 'tg.vocab')
 num_encoder_tokens = len(input_words)
 num_decoder_tokens = len(target_words)
 
-max_encoder_seq_length = max([len(tokenizer.tokenize(txt)) for txt in input_texts])
-max_decoder_seq_length = max([len(tokenizer.tokenize(txt)) for txt in target_texts])
-
-print("Samples:", min(len(input_text), len(target_text)))
+print("Samples:", samples)
 print("Unique input tokens:", num_encoder_tokens)
 #print("Input dictionary:", input_words)
 print("Unique output tokens:", num_decoder_tokens)
@@ -111,56 +119,96 @@ target_token_index = dict([w, i] for i, w in enumerate(target_words))
 # Free memory
 input_words = None
 target_words = None
-line_enc = None
-line_dec = None
-
-
-# Create three dimensional arrays
-# For each sentence -> maximum words -> binary of word index in B.O.W on or off
-encoder_input_data = np.zeros(
-    shape=(len(input_texts), max_encoder_seq_length, num_encoder_tokens),
-    dtype='float32'
-)
-decoder_input_data = np.zeros(
-    shape=(len(input_texts), max_decoder_seq_length, num_decoder_tokens),
-    dtype='float32'
-)
-decoder_target_data = np.zeros(
-    shape=(len(input_texts), max_decoder_seq_length, num_decoder_tokens),
-    dtype='float32'
-)
 
-for i, (input_text, target_text) in enumerate(zip(input_texts, target_texts)):
-    for t, w in enumerate(tokenizer.tokenize(input_text)):
-        if w not in input_token_index:
-            w = "<UNK>"
-        encoder_input_data[i, t, input_token_index[w]] = 1.
-    for t, w in enumerate(tokenizer.tokenize(target_text)):
-        if w not in target_token_index:
-            w = "<UNK>"
-        decoder_input_data[i, t, target_token_index[w]] = 1.
-        if t > 0:
-            decoder_target_data[i, t-1, target_token_index[w]] = 1.
-
-
-encoder_inputs = Input(shape=(None, num_encoder_tokens))
-encoder = LSTM(latent_dim, return_state=True)
-encoder_outputs, state_h, state_c = encoder(encoder_inputs)
-encoder_states = [state_h, state_c]
-
-decoder_inputs = Input(shape=(None, num_decoder_tokens))
-decoder_lstm = LSTM(latent_dim, return_sequences=True, return_state=True)
-decoder_outputs, _, _, = decoder_lstm(decoder_inputs, initial_state=encoder_states)
-decoder_dense = Dense(num_decoder_tokens, activation='softmax')
-decoder_outputs = decoder_dense(decoder_outputs)
-
-model = Model([encoder_inputs, decoder_inputs], decoder_outputs)
-model.compile(optimizer='adam', loss='categorical_crossentropy', metrics=['accuracy'])
-
-from keras.models import load_model
-from numpy .testing import assert_allclose
-model_found = False
-new_model = None
+if binary_corpus_path is not None and not from_binary:
+    print("Writing token corpus to", binary_corpus_path)
+    if streaming:
+        token_pairs = corpus.tokenize_pairs(
+            corpus.training_pairs(training_files, num_samples, data_sampling, data_weights, data_seed), max_seq_len)
+    else:
+        token_pairs = zip(input_tokens, target_tokens)
+    token_corpus.write_token_corpus(
+        binary_corpus_path, token_pairs, input_token_index, target_token_index, max_seq_len,
+        max_encoder_seq_length, max_decoder_seq_length, corpus_hash, training_files)
+    token_data = token_corpus.TokenCorpus(binary_corpus_path)
+    input_tokens = None
+    target_tokens = None
+
+if binary_corpus_path is None and not streaming:
+    # Create two dimensional arrays
+    # For each sentence -> maximum words -> id of the word (0 is padding)
+    encoder_input_data = corpus.vectorize_corpus(
+        input_tokens, input_token_index, max_encoder_seq_length, preprocess_workers)
+    decoder_input_data = corpus.vectorize_corpus(
+        target_tokens, target_token_index, max_decoder_seq_length, preprocess_workers)
+    input_tokens = None
+    target_tokens = None
+
+if len(bucket_boundaries) > 0:
+    if binary_corpus_path is None:
+        pairs = data_generator.ArrayPairs(encoder_input_data, decoder_input_data)
+    else:
+        pairs = token_data
+    train_indices, val_indices = data_generator.split_pairs(samples, validation_split)
+    train_sequence = data_generator.BucketSequence(pairs, train_indices, bucket_boundaries, batch_size)
+    val_sequence = data_generator.BucketSequence(pairs, val_indices, bucket_boundaries, batch_size, shuffle=False)
+    print("Bucketed training batches:", len(train_sequence))
+elif binary_corpus_path is not None:
+    train_batches, val_batches = data_generator.split_batches(
+        data_generator.batch_ranges(len(token_data), batch_size), validation_split)
+    train_sequence = data_generator.TokenCorpusSequence(token_data, train_batches)
+    val_sequence = data_generator.TokenCorpusSequence(token_data, val_batches)
+elif streaming:
+    train_batches, val_batches = data_generator.split_batches(batches, validation_split)
+    train_sequence = data_generator.CorpusSequence(
+        train_batches, input_token_index, target_token_index,
+        max_encoder_seq_length, max_decoder_seq_length, max_seq_len)
+    val_sequence = data_generator.CorpusSequence(
+        val_batches, input_token_index, target_token_index,
+        max_encoder_seq_length, max_decoder_seq_length, max_seq_len)
+else:
+    decoder_target_data = corpus.shift_targets(decoder_input_data)
+
+
+# Candidate words for decoding with a shortlist, their counts are what sampled softmax draws from
+# Both are counted on shortlist_pairs of the pairs trained on, drawn with data_seed from the ids already
+# at hand so they are not biased towards the files or lines that come first
+shortlist_file = None
+unigrams = None
+if use_shortlist or sampled_softmax > 0:
+    shortlist_rng = np.random.RandomState(data_seed)
+    if binary_corpus_path is not None:
+        shortlist_inputs, shortlist_targets = token_data.take(
+            shortlist.sample_indices(samples, shortlist.shortlist_pairs, shortlist_rng),
+            max_encoder_seq_length, max_decoder_seq_length)
+    elif streaming:
+        # Nothing is kept in memory, training batches picked at random are read again
+        shortlist_batches = []
+        shortlist_count = 0
+        for i in shortlist_rng.permutation(len(train_sequence)):
+            if shortlist_count >= shortlist.shortlist_pairs:
+                break
+            shortlist_batches.append(train_sequence[i][0])
+            shortlist_count += len(shortlist_batches[-1][0])
+        shortlist_inputs = np.concatenate([b[0] for b in shortlist_batches])[:shortlist.shortlist_pairs]
+        shortlist_targets = np.concatenate([b[1] for b in shortlist_batches])[:shortlist.shortlist_pairs]
+    else:
+        shortlist_indices = shortlist.sample_indices(samples, shortlist.shortlist_pairs, shortlist_rng)
+        shortlist_inputs = encoder_input_data[shortlist_indices]
+        shortlist_targets = decoder_input_data[shortlist_indices]
+    target_shortlist = shortlist.build(
+        shortlist_inputs, shortlist_targets, num_encoder_tokens, num_decoder_tokens,
+        shortlist.shortlist_size, shortlist.shortlist_aligned)
+    shortlist_file = shortlist.shortlist_path(os.path.join(bundle.here, bundle_file))
+    np.savez(shortlist_file, **target_shortlist)
+    unigrams = (target_shortlist['counts'] + 1).tolist()
+    shortlist_inputs = None
+    shortlist_targets = None
+
+model, encoder_model, decoder_model = seq2seq.build_models(
+    num_encoder_tokens, num_decoder_tokens, latent_dim, embedding_dim, sampled_softmax, unigrams)
+
+from numpy.testing import assert_allclose
 loaded_epoch = 0
 model_location = os.path.join(here, "model/bot-%d %dsamples (%d-%d-%d-%d).h5" % (
     max_seq_len,
@@ -171,151 +219,160 @@ model_location = os.path.join(here, "model/bot-%d %dsamples (%d-%d-%d-%d).h5" %
     vocab_size
     )
 )
-for e in range(epochs+1, 1, -1):
-    model_location = os.path.join(here, "model/bot-%d %dsamples (%d-%d-%d-%d).h5" % (
-        max_seq_len,
-        num_samples,
-        e,
-        batch_size,
-        latent_dim,
-        vocab_size
-        )
-    )
-    if os.path.isfile(model_location):
-        model_found = True
-        loaded_epoch = e
-        print("Previous model found with epoch: %d" % e)
-        model.load_weights(model_location)
-        new_model = load_model(model_location)
-        # Raise assertion error if of difference 1e-5
-        assert_allclose(
-            model.predict([encoder_inputs, decoder_inputs]),
-            new_model.predict([encoder_inputs, decoder_inputs]),
-            1e-5
+
+# Checkpoints of the same hyperparameters, whatever the number of epochs, can be resumed
+checkpoint_params = bundle.config_params(config['DEFAULT'], bundle.checkpoint_keys)
+checkpoint = checkpoints.find(manifest_file, checkpoint_params, epochs, verify_checkpoints)
+if checkpoint is None:
+    # Checkpoints written before the manifest existed
+    for e in range(epochs, 0, -1):
+        found_location = os.path.join(here, "model/bot-%d %dsamples (%d-%d-%d-%d).h5" % (
+            max_seq_len,
+            num_samples,
+            e,
+            batch_size,
+            latent_dim,
+            vocab_size
             )
-        break
+        )
+        if os.path.isfile(found_location):
+            checkpoint = checkpoints.record(manifest_file, found_location, e, checkpoint_params)
+            break
+
+if checkpoint is not None:
+    loaded_epoch = checkpoint['epoch']
+    print("Previous model found with epoch: %d" % loaded_epoch)
+    model.load_weights(checkpoint['path'])
 
-if not model_found or (model_found and loaded_epoch < epochs):
+if loaded_epoch < epochs:
     #Train
-    path="model/bot-%d %dsamples ({epoch}-%d-%d-%d).h5" % (
+    path = os.path.join(here, "model/bot-%d %dsamples ({epoch}-%d-%d-%d).h5" % (
         max_seq_len,
         num_samples,
         batch_size,
         latent_dim,
         vocab_size
         )
-    checkpoint = ModelCheckpoint(path, monitor='val_acc', verbose=1, save_best_only=True, mode='max')
-    if model_found:
-        model = new_model
-    model.fit(
-        [encoder_input_data, decoder_input_data],
-        decoder_target_data,
-        batch_size=batch_size,
-        callbacks=[checkpoint],
-        epochs=(epochs-loaded_epoch),
-        validation_split=0.05)
+    )
+    # Sampled softmax training has no accuracy, its val_loss comes from the full softmax
+    monitor = 'val_loss' if sampled_softmax > 0 else 'val_acc'
+    checkpoint_callback = checkpoints.ManifestCheckpoint(
+        path, manifest_file, checkpoint_params, monitor=monitor, mode='min' if sampled_softmax > 0 else 'max')
+    if sequences:
+        history = model.fit_generator(
+            train_sequence,
+            validation_data=val_sequence,
+            callbacks=[checkpoint_callback],
+            epochs=epochs,
+            initial_epoch=loaded_epoch,
+            workers=workers,
+            use_multiprocessing=workers > 1,
+            shuffle=True)
+    else:
+        history = model.fit(
+            [encoder_input_data, decoder_input_data],
+            np.expand_dims(decoder_target_data, -1),
+            batch_size=batch_size,
+            callbacks=[checkpoint_callback],
+            epochs=epochs,
+            initial_epoch=loaded_epoch,
+            validation_split=validation_split)
     model.save(model_location)
+    monitored = history.history.get(monitor)
+    checkpoints.record(manifest_file, model_location, epochs, checkpoint_params,
+                       monitor, float(monitored[-1]) if monitored else None)
+else:
+    model_location = checkpoint['path']
+
+# Export for the NumPy serving backend and make sure it agrees with Keras
+numpy_location = os.path.splitext(model_location)[0] + '.npz'
+seq2seq.export_numpy_weights(encoder_model, decoder_model, numpy_location)
+engine = numpy_lstm.NumpySeq2Seq(numpy_location, batch_size)
+if sequences:
+    check_seq = train_sequence[0][0][0]
+else:
+    check_seq = encoder_input_data[:batch_size]
+keras_states = encoder_model.predict(check_seq)
+numpy_states = engine.encode(check_seq)
+assert_allclose(keras_states, numpy_states, rtol=1e-4, atol=1e-5)
+go_seq = np.full((len(check_seq), 1), target_token_index["<GO>"], dtype='int32')
+assert_allclose(
+    decoder_model.predict([go_seq] + keras_states)[0][:, -1, :],
+    engine.step(go_seq, numpy_states[0], numpy_states[1])[0],
+    rtol=1e-4, atol=1e-5
+    )
 
-encoder_model = Model(encoder_inputs, encoder_states)
-
-decoder_state_input_h = Input(shape=(latent_dim,))
-decoder_state_input_c = Input(shape=(latent_dim,))
-decoder_states_inputs = [decoder_state_input_h, decoder_state_input_c]
-decoder_outputs, state_h, state_c = decoder_lstm(
-    decoder_inputs, initial_state=decoder_states_inputs
-)
-decoder_states = [state_h, state_c]
-decoder_outputs = decoder_dense(decoder_outputs)
-decoder_model = Model(
-    [decoder_inputs] + decoder_states_inputs,
-    [decoder_outputs] + decoder_states
+bundle.save_bundle(
+    bundle_file,
+    input_token_index,
+    target_token_index,
+    max_seq_len,
+    max_encoder_seq_length,
+    max_decoder_seq_length,
+    latent_dim,
+    embedding_dim,
+    model_location,
+    bundle.config_hash(config['DEFAULT']),
+    numpy_location,
+    shortlist_file
 )
+print("Serving bundle written to:", bundle_file)
 
-reverse_input_w_index = dict((i, w) for w, i in input_token_index.items())
-reverse_target_w_index = dict((i, w) for w, i in target_token_index.items())
-
-def sample(a, temperature=1.0):
-     a = np.array(a)**(1/temperature)
-     p_sum = sum(a)
-     for i in range(len(a)):
-         a[i] = a[i]/p_sum
-     print('a:', sum(a))
-     return np.argmax(np.random.multinomial(1, a, 1))
-
-'''def sample(a, randomness=1):
-    # randomness is how many other words may be possible
-    a = np.array(a)
-    max_score_indeces = a.argsort()[-(1+randomness):][::-1]
-    sorted_weights = []
-    for i in max_score_indeces:
-        sorted_weights.append((i, a[i]))
-    sorted_indeces, sorted_scores = zip(*sorted(sorted_weights, key=lambda x:float(x[1]), reverse=True))
-    """
-    for i in range(len(sorted_scores) - 1):
-        if i > 0:
-            if sorted_scores[i] * 0.90 > sorted_scores[i]: #if the next score is not within 90% of the initial one, cut the scoring
-                sorted_indeces = sorted_indeces[:i]
-                break
-    # print(list(sorted_weights))
-    """
-    total_score = sum(sorted_scores)
-    choice = random.random() * total_score
-    guess = 0
-    for i in range(len(sorted_indeces)):
-        guess += sorted_scores[i]
-        if choice >= guess:
-            return sorted_indeces[i]
-    return sorted_indeces[0]'''
-
-def decode_sequence(input_seq):
-    states_value = encoder_model.predict(input_seq)
-    target_seq = np.zeros((1, 1, num_decoder_tokens))
-    target_seq[0, 0, target_token_index["<GO>"]] = 1.
+input_vocab = vocabulary.Vocabulary.from_index(input_token_index)
+target_vocab = vocabulary.Vocabulary.from_index(target_token_index)
+
+default_sampler = sampling.Sampler('temperature', temperature=4)
+
+def decoder_step(target_seq, h, c):
+    output_tokens, h, c = decoder_model.predict([target_seq, h, c])
+    return (output_tokens[:, -1, :], h, c)
+
+def decode_sequence(input_seq, sampler=default_sampler):
+    if sampler.strategy == 'beam':
+        tokens = sampling.beam_search(
+            encoder_model.predict, decoder_step, input_seq, target_token_index["<GO>"],
+            target_token_index["<EOS>"], max_decoder_seq_length, sampler.beam_width)
+        return "".join(target_vocab[t] + " " for t in tokens)
+
+    h, c = encoder_model.predict(input_seq)
+    target_seq = np.array([[target_token_index["<GO>"]]], dtype='int32')
 
     stop_condition = False
     decoded_sentence = ""
     while not stop_condition:
-        output_tokens, h, c = decoder_model.predict([target_seq] + states_value)
+        output_tokens, h, c = decoder_step(target_seq, h, c)
 
-        # sampled_token_index = np.argmax(output_tokens[0, -1, :])
-        sampled_token_index = sample(output_tokens[0, -1, :], 4)
-        sampled_w = reverse_target_w_index[sampled_token_index]
+        sampled_token_index = int(sampler(output_tokens)[0])
+        sampled_w = target_vocab[sampled_token_index]
         # print("sampled token index:", sampled_token_index, "word:", sampled_w)
         decoded_sentence += sampled_w + " "
 
         if sampled_w == "<EOS>" or len(decoded_sentence.split(' ')) > max_decoder_seq_length:
             stop_condition = True
-        
-        target_seq = np.zeros((1, 1, num_decoder_tokens))
-        target_seq[0, 0, sampled_token_index] = 1.
 
-        states_value = [h, c]
-    
+        target_seq[0, 0] = sampled_token_index
+
     return decoded_sentence
 
 def sentence_to_seq(sentence):
-    sentence = tokenizer.tokenize(sentence)
-    seq = np.zeros((1, max_encoder_seq_length, num_encoder_tokens), dtype='float32')
-    
-    read_sentence = ""
-    for i in range(min(max_encoder_seq_length, len(sentence))):
-        w = sentence[i].lower()
-        if w not in list(reverse_input_w_index.values()):
-            w = "<UNK>"
-        seq[0, i, input_token_index[w]] = 1.
-        read_sentence += w + " "
-        
-    # print("Read sentence: ", read_sentence)
-
-    return (seq, read_sentence)
-
-for seq_index in range(20):
+    seqs, read_sentences = input_vocab.encode([sentence], max_encoder_seq_length)
+    return (seqs, read_sentences[0])
+
+# The first pairs trained on, from the ids already at hand rather than another pass over the files
+if binary_corpus_path is not None:
+    sample_seqs = token_data.batch(0, 20)[0]
+elif streaming:
+    sample_seqs = check_seq[:20]
+else:
+    sample_seqs = encoder_input_data[:20]
+for seq_index in range(len(sample_seqs)):
     # Take one sequence (part of the training set)
     # for trying out decoding.
-    input_seq = encoder_input_data[seq_index:seq_index+1]
+    input_seq = sample_seqs[seq_index:seq_index+1]
+    input_text = " ".join(input_vocab.decode(input_seq[0]))
     decoded_sentence = decode_sequence(input_seq)
     print('-')
-    print('Input sentence:', input_texts[seq_index])
+    print('Input sentence:', input_text)
     print('Decoded sentence:', decoded_sentence)
 
 # b = Bot()
@@ -0,0 +1,39 @@
+# Replies to a file of prompts, one per line like data/custom.enc, and writes one reply per line
+# Usage: python bulk_reply.py <prompts file> [<replies file>] [--batch-size N] [--strategy name]
+#        [--temperature T] [--k K] [--p P] [--beam-width W] [--seed S]
+# Replies go to stdout without a replies file. Every --batch-size prompts are vectorized together,
+# encoded once and decoded in lockstep through serving.chat_batch, with the model of config.ini
+from __future__ import print_function
+from io import open
+import sys
+import time
+import cli
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    batch_size = int(cli.option(args, '--batch-size', 256))
+    settings = {}
+    for name in ('strategy', 'temperature', 'k', 'p', 'beam_width', 'seed'):
+        value = cli.option(args, '--' + name.replace('_', '-'), None)
+        if value is not None:
+            settings[name] = value
+    if len(args) not in (1, 2):
+        sys.exit("Usage: python bulk_reply.py <prompts file> [<replies file>] [--batch-size N] [--strategy name] ...")
+
+    import serving
+    batch_size = min(batch_size, serving.max_bulk_size)
+    with open(args[0], 'r', encoding='utf-8') as f:
+        prompts = [line.rstrip("\n") for line in f]
+
+    out = open(args[1], 'w', encoding='utf-8') if len(args) == 2 else sys.stdout
+    start = time.perf_counter()
+    try:
+        for i in range(0, len(prompts), batch_size):
+            for _, reply in serving.chat_batch(prompts[i:i+batch_size], settings):
+                out.write(reply.strip() + "\n")
+            out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    elapsed = time.perf_counter() - start
+    print("%d replies in %.1fs (%.1f/s)" % (len(prompts), elapsed, len(prompts) / max(elapsed, 1e-9)), file=sys.stderr)
@@ -0,0 +1,106 @@
+# Serving bundle: everything flaskapp.py needs to start without re-reading the training corpus
+from io import open
+import hashlib
+import json
+import os
+import os.path
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+# config.ini settings that change what a trained model looks like
+hashed_keys = [
+    'max_seq_len',
+    'num_samples',
+    'epochs',
+    'batch_size',
+    'latent_dim',
+    'embedding_dim',
+    'vocab_size',
+    'data_path',
+    'data',
+    'data_sampling',
+    'data_weights',
+    'data_seed'
+]
+
+# Settings added after models were already trained, only part of the hashes when they are set
+# so that older configs keep their hashes
+optional_keys = ['data_sampling', 'data_weights', 'data_seed']
+
+# Settings a checkpoint has to share to be resumed, any number of epochs will do
+checkpoint_keys = [key for key in hashed_keys if key != 'epochs']
+
+# Settings that change the token ids of a binary corpus (see token_corpus.py)
+corpus_keys = [
+    'max_seq_len',
+    'num_samples',
+    'vocab_size',
+    'data_path',
+    'data',
+    'data_sampling',
+    'data_weights',
+    'data_seed'
+]
+
+def config_params(section, keys=hashed_keys):
+    return dict((key, section.get(key)) for key in keys if key not in optional_keys or key in section)
+
+def config_hash(section, keys=hashed_keys):
+    params = config_params(section, keys)
+    return hashlib.sha1(json.dumps(params, sort_keys=True).encode('utf-8')).hexdigest()
+
+def save_bundle(filename, input_token_index, target_token_index, max_seq_len,
+                max_encoder_seq_length, max_decoder_seq_length, latent_dim, embedding_dim,
+                weights, config_hash, numpy_weights=None, shortlist=None):
+    data = {
+        # Vocabularies are stored as lists ordered by token id
+        'input_vocab': sorted(input_token_index, key=input_token_index.get),
+        'target_vocab': sorted(target_token_index, key=target_token_index.get),
+        'max_seq_len': max_seq_len,
+        'max_encoder_seq_length': max_encoder_seq_length,
+        'max_decoder_seq_length': max_decoder_seq_length,
+        'latent_dim': latent_dim,
+        'embedding_dim': embedding_dim,
+        'weights': os.path.relpath(weights, here),
+        # Same weights exported for the NumPy serving backend
+        'numpy_weights': os.path.relpath(numpy_weights, here) if numpy_weights is not None else None,
+        'config_hash': config_hash,
+        # Candidate words of the decode-time shortlist (see shortlist.py)
+        'shortlist': os.path.relpath(shortlist, here) if shortlist is not None else None
+    }
+    path = os.path.join(here, filename)
+    # Write to a temporary file first so a running server never reads a half written bundle
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+    os.replace(path + '.tmp', path)
+
+def update_bundle(filename, fields):
+    path = os.path.join(here, filename)
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    data.update(fields)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+    os.replace(path + '.tmp', path)
+
+def update_weights(filename, weights, numpy_weights=None):
+    # Points an existing bundle at other weights, e.g. a newer version from trainer.py
+    update_bundle(filename, {
+        'weights': os.path.relpath(weights, here),
+        'numpy_weights': os.path.relpath(numpy_weights, here) if numpy_weights is not None else None
+    })
+
+def update_shortlist(filename, shortlist):
+    update_bundle(filename, {'shortlist': os.path.relpath(shortlist, here)})
+
+def load_bundle(filename):
+    with open(os.path.join(here, filename), 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    data['weights'] = os.path.join(here, data['weights'])
+    if data.get('numpy_weights') is not None:
+        data['numpy_weights'] = os.path.join(here, data['numpy_weights'])
+    if data.get('shortlist') is not None:
+        data['shortlist'] = os.path.join(here, data['shortlist'])
+    data['input_token_index'] = dict([w, i] for i, w in enumerate(data['input_vocab']))
+    data['target_token_index'] = dict([w, i] for i, w in enumerate(data['target_vocab']))
+    return data
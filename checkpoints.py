@@ -0,0 +1,87 @@
+# JSON index of the checkpoints bot.py has written, so a restart finds the latest one with a
+# single lookup instead of probing file names, and can check it by hash instead of by predictions
+from io import open
+import hashlib
+import json
+import os
+import os.path
+import time
+from keras.callbacks import Callback
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+def params_hash(params):
+    return hashlib.sha1(json.dumps(params, sort_keys=True).encode('utf-8')).hexdigest()
+
+def file_hash(path):
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+def load_manifest(manifest_file):
+    if not os.path.isfile(manifest_file):
+        return {'checkpoints': []}
+    with open(manifest_file, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def record(manifest_file, path, epoch, params, monitor=None, value=None):
+    # Adds or replaces the entry of path and returns it
+    manifest = load_manifest(manifest_file)
+    entry = {
+        'file': os.path.relpath(os.path.abspath(path), here),
+        'epoch': epoch,
+        'params': params,
+        'params_hash': params_hash(params),
+        'monitor': monitor,
+        'value': value,
+        'sha1': file_hash(path),
+        'created': time.time()
+    }
+    manifest['checkpoints'] = [c for c in manifest['checkpoints'] if c['file'] != entry['file']] + [entry]
+    with open(manifest_file + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(manifest_file + '.tmp', manifest_file)
+    return dict(entry, path=os.path.join(here, entry['file']))
+
+def find(manifest_file, params, max_epoch, verify=False):
+    # Latest checkpoint of the same hyperparameters up to max_epoch, None when there is none
+    # With verify a file whose hash changed is skipped in favor of the one before it
+    wanted = params_hash(params)
+    candidates = [c for c in load_manifest(manifest_file)['checkpoints']
+                  if c['params_hash'] == wanted and c['epoch'] <= max_epoch]
+    for entry in sorted(candidates, key=lambda c: (c['epoch'], c['created']), reverse=True):
+        path = os.path.join(here, entry['file'])
+        if not os.path.isfile(path):
+            continue
+        if verify and file_hash(path) != entry['sha1']:
+            print("Checkpoint", entry['file'], "does not match its hash, skipping it")
+            continue
+        return dict(entry, path=path)
+    return None
+
+class ManifestCheckpoint(Callback):
+    # ModelCheckpoint(save_best_only=True) that records every save in the manifest
+    def __init__(self, filepath, manifest_file, params, monitor='val_acc', mode='max'):
+        super(ManifestCheckpoint, self).__init__()
+        self.filepath = filepath
+        self.manifest_file = manifest_file
+        self.params = params
+        self.monitor = monitor
+        self.mode = mode
+        self.best = None
+
+    def on_epoch_end(self, epoch, logs=None):
+        value = (logs or {}).get(self.monitor)
+        if value is None:
+            print("Can save best model only with %s available, skipping" % self.monitor)
+            return
+        value = float(value)
+        if self.best is not None and (value <= self.best if self.mode == 'max' else value >= self.best):
+            return
+        print("Epoch %d: %s improved to %.5f, saving model" % (epoch + 1, self.monitor, value))
+        self.best = value
+        path = self.filepath.format(epoch=epoch + 1)
+        self.model.save(path, overwrite=True)
+        record(self.manifest_file, path, epoch + 1, self.params, self.monitor, value)
@@ -0,0 +1,19 @@
+# Command line options of the scripts (benchmark.py, bulk_reply.py, quantize.py, shortlist.py),
+# each taken out of args so whatever is left are the positional arguments
+
+def option(args, name, default):
+    # Value following name, or default without it
+    if name in args:
+        i = args.index(name)
+        if i + 1 == len(args):
+            raise SystemExit("%s needs a value" % name)
+        value = args[i+1]
+        del args[i:i+2]
+        return value
+    return default
+
+def flag(args, name):
+    if name in args:
+        args.remove(name)
+        return True
+    return False
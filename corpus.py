@@ -0,0 +1,204 @@
+# Helpers shared by the training and serving code to read and vectorize the +++$+++ corpora
+from io import open
+from collections import OrderedDict
+import heapq
+import itertools
+import math
+import multiprocessing
+import random
+import numpy as np
+from nltk.tokenize import RegexpTokenizer
+
+tokenizer = RegexpTokenizer(r'\w+|\<[A-Z]+\>|\$[a-z]+|&[a-z]+;|[a-z]?\'[a-z]+|[.?!]') # Special commands are: $command
+separator = '+++$+++'
+
+def split_pair(line):
+    data = line.split(separator)
+    if len(data) < 2:
+        return None
+    return (data[0], data[1])
+
+def read_pairs(paths, num_samples=None):
+    # Yields (input line, target line) one line at a time so whole files are never held in memory
+    count = 0
+    for path in paths:
+        with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+            for line in f:
+                if num_samples is not None and count >= num_samples:
+                    return
+                pair = split_pair(line)
+                if pair is None:
+                    continue
+                count += 1
+                yield pair
+
+def sample_lines(paths, num_samples, weights=None, seed=0):
+    # Weighted reservoir sampling (Efraimidis-Spirakis) of the pair lines of every file in one pass:
+    # each line gets the key log(u) / weight of its file and the num_samples largest keys are kept,
+    # so a line of a file of weight 2 is twice as likely to be kept as one of weight 1 and memory
+    # only grows with num_samples. Returns the (path, start, end) byte ranges shuffled with seed, since
+    # validation holds out the last pairs and in file order those would all come from the last file
+    if weights is not None and len(weights) != len(paths):
+        raise ValueError("Expected one weight per training file, got %d for %d files" % (len(weights), len(paths)))
+    rng = random.Random(seed)
+    marker = separator.encode('utf-8')
+    reservoir = []
+    for i, path in enumerate(paths):
+        weight = weights[i] if weights is not None else 1.
+        if weight <= 0:
+            continue
+        with open(path, 'rb') as f:
+            start = 0
+            for line in f:
+                end = start + len(line)
+                if marker in line:
+                    key = math.log(1. - rng.random()) / weight
+                    if len(reservoir) < num_samples:
+                        heapq.heappush(reservoir, (key, i, start, end))
+                    elif key > reservoir[0][0]:
+                        heapq.heapreplace(reservoir, (key, i, start, end))
+                start = end
+    ranges = [(paths[i], start, end) for _, i, start, end in sorted(reservoir, key=lambda r: (r[1], r[2]))]
+    rng.shuffle(ranges)
+    return ranges
+
+def read_ranges(ranges):
+    # Yields the pair of every (path, start, end) line range, each file is opened once
+    files = {}
+    try:
+        for path, start, end in ranges:
+            if path not in files:
+                files[path] = open(path, 'rb')
+            f = files[path]
+            f.seek(start)
+            pair = split_pair(f.read(end - start).decode('utf-8', errors='ignore'))
+            if pair is not None:
+                yield pair
+    finally:
+        for f in files.values():
+            f.close()
+
+def training_pairs(paths, num_samples=None, sampling='first', weights=None, seed=0):
+    # The pairs to train on: the first num_samples of the files, or with reservoir
+    # num_samples pairs drawn from all of them
+    if sampling not in ('first', 'reservoir'):
+        raise ValueError("Unknown data_sampling: %s" % sampling)
+    if sampling == 'first' or num_samples is None:
+        return read_pairs(paths, num_samples)
+    return read_ranges(sample_lines(paths, num_samples, weights, seed))
+
+def sampling_settings(section):
+    # (data_sampling, data_weights, data_seed) of a config section, for training_pairs
+    weights = [float(w) for w in section.get('data_weights', '').split(',') if w.strip()]
+    return (section.get('data_sampling', 'first'), weights or None, int(section.get('data_seed', 0)))
+
+def prepare_pair(input_line, target_line, max_seq_len):
+    input_text = input_line.lower()
+    target_text = "<GO> " + target_line + " <EOS>"
+
+    if len(input_text.split(' ')) > max_seq_len:
+        input_text = " ".join(input_text.split(' ')[:max_seq_len])
+    if len(target_text.split(' ')) > max_seq_len:
+        target_text = " ".join(target_text.split(' ')[:max_seq_len-1]) + " <EOS>"
+    return (input_text, target_text)
+
+def count_words(words, tokens, vocab_size):
+    # New words are only added while the vocab still has room, the rest become <UNK> later on
+    for w in tokens:
+        if w in words:
+            words[w] += 1
+        elif len(words) < vocab_size:
+            words[w] = 1
+
+def merge_counts(words, counts, vocab_size):
+    # Same result as count_words over the tokens the counts were taken from, as long as
+    # the counts are merged in corpus order and list words in order of first appearance
+    for w, n in counts.items():
+        if w in words:
+            words[w] += n
+        elif len(words) < vocab_size:
+            words[w] = n
+
+def vectorize_tokens(token_lists, token_index, seq_length):
+    # Padded matrix of token ids, 0 being <PAD>
+    data = np.zeros(shape=(len(token_lists), seq_length), dtype='int32')
+    unk = token_index["<UNK>"]
+    for i, tokens in enumerate(token_lists):
+        for t, w in enumerate(tokens[:seq_length]):
+            data[i, t] = token_index.get(w, unk)
+    return data
+
+def vectorize(texts, token_index, seq_length):
+    return vectorize_tokens([tokenizer.tokenize(text) for text in texts], token_index, seq_length)
+
+def shift_targets(decoder_input_data):
+    # The decoder learns to predict its own input one step ahead
+    decoder_target_data = np.zeros_like(decoder_input_data)
+    decoder_target_data[:, :-1] = decoder_input_data[:, 1:]
+    return decoder_target_data
+
+def tokenize_pairs(pairs, max_seq_len):
+    for input_line, target_line in pairs:
+        input_text, target_text = prepare_pair(input_line, target_line, max_seq_len)
+        yield (tokenizer.tokenize(input_text), tokenizer.tokenize(target_text))
+
+def tokenize_shard(args):
+    # Every line is prepared and tokenized exactly once, the word counts are
+    # uncapped and keep the order in which the words first appear
+    pairs, max_seq_len = args
+    input_tokens = []
+    target_tokens = []
+    input_counts = OrderedDict()
+    target_counts = OrderedDict()
+    for input_line, target_line in pairs:
+        input_text, target_text = prepare_pair(input_line, target_line, max_seq_len)
+        for tokens, counts, text in ((input_tokens, input_counts, input_text), (target_tokens, target_counts, target_text)):
+            tokens.append(tokenizer.tokenize(text))
+            for w in tokens[-1]:
+                counts[w] = counts.get(w, 0) + 1
+    return (input_tokens, target_tokens, input_counts, target_counts)
+
+def vectorize_shard(args):
+    return vectorize_tokens(*args)
+
+def shards(items, shard_size):
+    items = iter(items)
+    while True:
+        shard = list(itertools.islice(items, shard_size))
+        if len(shard) == 0:
+            return
+        yield shard
+
+def map_shards(fn, args, processes):
+    # Results come back in shard order whatever the number of processes. The pool is
+    # forked so a script calling this (bot.py) is not run again in every worker
+    if processes <= 1 or 'fork' not in multiprocessing.get_all_start_methods():
+        for a in args:
+            yield fn(a)
+        return
+    pool = multiprocessing.get_context('fork').Pool(processes)
+    try:
+        for result in pool.imap(fn, args):
+            yield result
+    finally:
+        pool.terminate()
+
+def tokenize_corpus(pairs, max_seq_len, input_words, target_words, vocab_size, processes=1, shard_size=5000):
+    # Parallel version of the prepare_pair / count_words loop, counts go into input_words and target_words
+    # Returns the token lists of every pair
+    input_tokens = []
+    target_tokens = []
+    args = ((shard, max_seq_len) for shard in shards(pairs, shard_size))
+    for shard_input, shard_target, input_counts, target_counts in map_shards(tokenize_shard, args, processes):
+        input_tokens += shard_input
+        target_tokens += shard_target
+        merge_counts(input_words, input_counts, vocab_size)
+        merge_counts(target_words, target_counts, vocab_size)
+    return (input_tokens, target_tokens)
+
+def vectorize_corpus(token_lists, token_index, seq_length, processes=1, shard_size=5000):
+    args = ((shard, token_index, seq_length) for shard in shards(token_lists, shard_size))
+    parts = list(map_shards(vectorize_shard, args, processes))
+    if len(parts) == 0:
+        return np.zeros(shape=(0, seq_length), dtype='int32')
+    return np.concatenate(parts)
@@ -0,0 +1,181 @@
+# Streams training batches from the +++$+++ files so memory is bound by batch_size instead of num_samples
+from io import open
+import numpy as np
+from keras.utils import Sequence
+import corpus
+
+def scan_corpus(paths, batch_size, max_seq_len, vocab_size, num_samples=None, sampling='first', weights=None, seed=0):
+    # Single pass over the files that only keeps the word counts, the longest
+    # sequences and the byte range of every batch so it can be re-read later
+    # With reservoir sampling (see corpus.training_pairs) a batch is the list of its line ranges instead
+    input_words = dict([("<UNK>", 0)])
+    target_words = dict([("<GO>", 0), ("<UNK>", 0), ("<EOS>", 0)])
+    lengths = [0, 0]
+    batches = []
+
+    def scan(pair):
+        input_text, target_text = corpus.prepare_pair(pair[0], pair[1], max_seq_len)
+        input_tokens = corpus.tokenizer.tokenize(input_text)
+        target_tokens = corpus.tokenizer.tokenize(target_text)
+        corpus.count_words(input_words, input_tokens, vocab_size)
+        corpus.count_words(target_words, target_tokens, vocab_size)
+        lengths[0] = max(lengths[0], len(input_tokens))
+        lengths[1] = max(lengths[1], len(target_tokens))
+
+    if sampling == 'reservoir' and num_samples is not None:
+        ranges = corpus.sample_lines(paths, num_samples, weights, seed)
+        for pair in corpus.read_ranges(ranges):
+            scan(pair)
+        batches = [ranges[i:i+batch_size] for i in range(0, len(ranges), batch_size)]
+        return (batches, len(ranges), input_words, target_words, lengths[0], lengths[1])
+    if sampling not in ('first', 'reservoir'):
+        raise ValueError("Unknown data_sampling: %s" % sampling)
+
+    count = 0
+    for path in paths:
+        with open(path, 'rb') as f:
+            start = f.tell()
+            in_batch = 0
+            for line in iter(f.readline, b''):
+                if num_samples is not None and count >= num_samples:
+                    break
+                pair = corpus.split_pair(line.decode('utf-8', errors='ignore'))
+                if pair is None:
+                    continue
+                scan(pair)
+
+                count += 1
+                in_batch += 1
+                if in_batch == batch_size:
+                    batches.append((path, start, f.tell()))
+                    start = f.tell()
+                    in_batch = 0
+            if in_batch > 0:
+                batches.append((path, start, f.tell()))
+
+    return (batches, count, input_words, target_words, lengths[0], lengths[1])
+
+def split_batches(batches, validation_split):
+    # Holds out the last batches for validation, like model.fit(validation_split=...)
+    num_val = int(len(batches) * validation_split)
+    if validation_split > 0 and len(batches) > 1:
+        num_val = max(1, num_val)
+    return (batches[:len(batches)-num_val], batches[len(batches)-num_val:])
+
+def batch_ranges(pairs, batch_size):
+    return [(start, min(start + batch_size, pairs)) for start in range(0, pairs, batch_size)]
+
+class CorpusSequence(Sequence):
+    def __init__(self, batches, input_token_index, target_token_index,
+                 max_encoder_seq_length, max_decoder_seq_length, max_seq_len):
+        self.batches = batches
+        self.input_token_index = input_token_index
+        self.target_token_index = target_token_index
+        self.max_encoder_seq_length = max_encoder_seq_length
+        self.max_decoder_seq_length = max_decoder_seq_length
+        self.max_seq_len = max_seq_len
+
+    def __len__(self):
+        return len(self.batches)
+
+    def __getitem__(self, idx):
+        batch = self.batches[idx]
+        if isinstance(batch, list):
+            pairs = corpus.read_ranges(batch)
+        else:
+            path, start, end = batch
+            with open(path, 'rb') as f:
+                f.seek(start)
+                chunk = f.read(end - start)
+            pairs = (corpus.split_pair(line.decode('utf-8', errors='ignore')) for line in chunk.split(b'\n'))
+
+        input_texts = []
+        target_texts = []
+        for pair in pairs:
+            if pair is None:
+                continue
+            input_text, target_text = corpus.prepare_pair(pair[0], pair[1], self.max_seq_len)
+            input_texts.append(input_text)
+            target_texts.append(target_text)
+
+        encoder_input_data = corpus.vectorize(input_texts, self.input_token_index, self.max_encoder_seq_length)
+        decoder_input_data = corpus.vectorize(target_texts, self.target_token_index, self.max_decoder_seq_length)
+        decoder_target_data = corpus.shift_targets(decoder_input_data)
+        return ([encoder_input_data, decoder_input_data], np.expand_dims(decoder_target_data, -1))
+
+class TokenCorpusSequence(Sequence):
+    # Batches sliced straight out of a memory mapped token_corpus.TokenCorpus
+    def __init__(self, token_corpus, batches):
+        self.token_corpus = token_corpus
+        self.batches = batches
+
+    def __len__(self):
+        return len(self.batches)
+
+    def __getitem__(self, idx):
+        encoder_input_data, decoder_input_data = self.token_corpus.batch(*self.batches[idx])
+        decoder_target_data = corpus.shift_targets(decoder_input_data)
+        return ([encoder_input_data, decoder_input_data], np.expand_dims(decoder_target_data, -1))
+
+def bucket_batches(encoder_lengths, decoder_lengths, boundaries, batch_size, rng=None):
+    # Positions grouped into batches that never mix (encoder, decoder) length buckets, a
+    # bucket holds the lengths up to its boundary. rng shuffles inside and across buckets
+    width = len(boundaries) + 1
+    keys = np.searchsorted(boundaries, encoder_lengths) * width + np.searchsorted(boundaries, decoder_lengths)
+    batches = []
+    for key in np.unique(keys):
+        members = np.flatnonzero(keys == key)
+        if rng is not None:
+            rng.shuffle(members)
+        batches += [members[i:i+batch_size] for i in range(0, len(members), batch_size)]
+    if rng is not None:
+        batches = [batches[i] for i in rng.permutation(len(batches))]
+    return batches
+
+def split_pairs(count, validation_split):
+    # Holds out the last pairs for validation, like model.fit(validation_split=...)
+    num_val = int(count * validation_split)
+    return (np.arange(count - num_val), np.arange(count - num_val, count))
+
+class ArrayPairs(object):
+    # In-memory id matrices with the take() of token_corpus.TokenCorpus
+    def __init__(self, encoder_input_data, decoder_input_data):
+        self.encoder_input_data = encoder_input_data
+        self.decoder_input_data = decoder_input_data
+
+    def lengths(self, indices=None):
+        if indices is None:
+            indices = slice(None)
+        return ((self.encoder_input_data[indices] != 0).sum(axis=1), (self.decoder_input_data[indices] != 0).sum(axis=1))
+
+    def take(self, indices, encoder_width, decoder_width):
+        return (self.encoder_input_data[indices, :encoder_width], self.decoder_input_data[indices, :decoder_width])
+
+class BucketSequence(Sequence):
+    # Batches padded to their own longest pair instead of the longest one in the corpus
+    def __init__(self, pairs, indices, boundaries, batch_size, shuffle=True, seed=0):
+        self.pairs = pairs
+        self.indices = indices
+        self.boundaries = boundaries
+        self.batch_size = batch_size
+        self.encoder_lengths, self.decoder_lengths = pairs.lengths(indices)
+        self.rng = np.random.RandomState(seed) if shuffle else None
+        self.on_epoch_end()
+
+    def on_epoch_end(self):
+        if self.rng is not None or not hasattr(self, 'batches'):
+            self.batches = bucket_batches(
+                self.encoder_lengths, self.decoder_lengths, self.boundaries, self.batch_size, self.rng)
+
+    def __len__(self):
+        return len(self.batches)
+
+    def __getitem__(self, idx):
+        # Sorted so reads from a memory mapped corpus go forward
+        positions = np.sort(self.batches[idx])
+        encoder_input_data, decoder_input_data = self.pairs.take(
+            self.indices[positions],
+            max(1, int(self.encoder_lengths[positions].max())),
+            max(1, int(self.decoder_lengths[positions].max())))
+        decoder_target_data = corpus.shift_targets(decoder_input_data)
+        return ([encoder_input_data, decoder_input_data], np.expand_dims(decoder_target_data, -1))
@@ -1,15 +1,96 @@
 # Used to clean up the training information
 # Usage: python data_parser.py <input training> <target training> <name of encoded output>
+#            [--dedup] [--max-seq-len N] [--shard-size N]
+# Both files are read line by line in step, so dumps of any size are paired in constant memory
+# --dedup          drop pairs already written (kept as 8 byte hashes)
+# --max-seq-len N  drop pairs bot.py would truncate with the same max_seq_len
+# --shard-size N   write N pairs per file, <output>-00000, <output>-00001... listed with
+#                  their counts in <output>.shards
+from io import open
+import hashlib
 import os.path as op
 import sys
+import cli
+from corpus import separator
 
-i = []
-o = []
-with open(op.join(op.dirname(__file__), sys.argv[1]), 'r', encoding='utf-8') as f:
-    i = f.read().split('\n')
-with open(op.join(op.dirname(__file__), sys.argv[2]), 'r', encoding='utf-8') as f:
-    o = f.read().split('\n')
-with open(op.join(op.dirname(__file__), sys.argv[3]), 'w', encoding='utf-8') as f:
-    for ind in range(min(len(i), len(o))):
-        if i[ind] != '' and o[ind] != '':
-            f.write(i[ind] + '+++$+++' + o[ind] + '\n')
+write_every = 10000
+
+def too_long(input_line, target_line, max_seq_len):
+    # Same word counts as corpus.prepare_pair, the target gets <GO> and <EOS> added
+    return len(input_line.split(' ')) > max_seq_len or len(target_line.split(' ')) + 2 > max_seq_len
+
+def parse_pairs(input_path, target_path, dedup=False, max_seq_len=None):
+    seen = set()
+    with open(input_path, 'r', encoding='utf-8', errors='ignore') as fi, \
+            open(target_path, 'r', encoding='utf-8', errors='ignore') as fo:
+        for input_line, target_line in zip(fi, fo):
+            input_line = input_line.rstrip('\r\n')
+            target_line = target_line.rstrip('\r\n')
+            if input_line == '' or target_line == '':
+                continue
+            if separator in input_line or separator in target_line:
+                continue
+            if max_seq_len is not None and too_long(input_line, target_line, max_seq_len):
+                continue
+            if dedup:
+                digest = hashlib.blake2b((input_line + separator + target_line).encode('utf-8'), digest_size=8).digest()
+                if digest in seen:
+                    continue
+                seen.add(digest)
+            yield input_line + separator + target_line + '\n'
+
+def write_shards(lines, output_path, shard_size=None):
+    # Returns [(file name, records)], lines are buffered and written in bulk
+    shards = []
+    out = None
+    buffer = []
+    count = 0
+    for line in lines:
+        if out is None:
+            name = output_path if shard_size is None else '%s-%05d' % (output_path, len(shards))
+            out = open(name, 'w', encoding='utf-8')
+            shards.append([name, 0])
+        buffer.append(line)
+        count += 1
+        if len(buffer) >= write_every:
+            out.write(''.join(buffer))
+            buffer = []
+        if shard_size is not None and count == shard_size:
+            out.write(''.join(buffer))
+            out.close()
+            shards[-1][1] = count
+            out = None
+            buffer = []
+            count = 0
+    if out is not None:
+        out.write(''.join(buffer))
+        out.close()
+        shards[-1][1] = count
+    return [tuple(s) for s in shards]
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    dedup = cli.flag(args, '--dedup')
+    max_seq_len = cli.option(args, '--max-seq-len', None)
+    max_seq_len = int(max_seq_len) if max_seq_len is not None else None
+    shard_size = cli.option(args, '--shard-size', None)
+    shard_size = int(shard_size) if shard_size is not None else None
+    if len(args) != 3:
+        sys.exit("Usage: python data_parser.py <input training> <target training> <name of encoded output> "
+                 "[--dedup] [--max-seq-len N] [--shard-size N]")
+
+    here = op.dirname(__file__)
+    output_path = op.join(here, args[2])
+    shards = write_shards(
+        parse_pairs(op.join(here, args[0]), op.join(here, args[1]), dedup, max_seq_len),
+        output_path, shard_size)
+
+    if shard_size is not None:
+        with open(output_path + '.shards', 'w', encoding='utf-8') as f:
+            for name, records in shards:
+                f.write(u'%s\t%d\n' % (op.basename(name), records))
+    for name, records in shards:
+        print(op.basename(name), records)
+    print("Pairs written:", sum(records for _, records in shards))
+    if shard_size is not None:
+        print("data =", ",".join(op.basename(name) for name, _ in shards))
@@ -0,0 +1,119 @@
+# In-process counters and histograms for the serving hot path, exposed by flaskapp.py on /metrics
+# in the Prometheus text format. Recording is a bisect and a dict update under a lock, set
+# metrics = no in config.ini to turn it off completely
+from configparser import ConfigParser
+import bisect
+import os.path
+import threading
+
+config = ConfigParser()
+config.read(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config.ini'))
+enabled = config['DEFAULT'].getboolean('metrics', True)
+
+# Seconds, from a single decoder step up to a slow reply
+latency_buckets = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1., 2.5, 5., 10.)
+
+registry = []
+
+class Counter(object):
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.values = {}
+        self.lock = threading.Lock()
+        registry.append(self)
+
+    def inc(self, amount=1, labels=()):
+        if not enabled:
+            return
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def snapshot(self):
+        with self.lock:
+            return {'type': 'counter', 'help': self.help, 'labelnames': self.labelnames, 'values': dict(self.values)}
+
+class Gauge(object):
+    # Read when /metrics is scraped, fn returns the current value
+    def __init__(self, name, help, fn):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        registry.append(self)
+
+    def snapshot(self):
+        return {'type': 'gauge', 'help': self.help, 'labelnames': (), 'values': {(): self.fn()}}
+
+class Histogram(object):
+    def __init__(self, name, help, buckets=latency_buckets, labelnames=()):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.labelnames = labelnames
+        # labels -> [count per bucket..., count above the last bucket, sum]
+        self.values = {}
+        self.lock = threading.Lock()
+        registry.append(self)
+
+    def observe(self, value, labels=()):
+        if not enabled:
+            return
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            counts = self.values.get(labels)
+            if counts is None:
+                counts = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.]
+            counts[i] += 1
+            counts[-1] += value
+
+    def snapshot(self):
+        with self.lock:
+            return {'type': 'histogram', 'help': self.help, 'labelnames': self.labelnames,
+                    'buckets': self.buckets, 'values': dict((k, list(v)) for k, v in self.values.items())}
+
+def snapshot():
+    # Plain dicts so worker processes can send theirs over a pipe
+    return dict((m.name, m.snapshot()) for m in registry)
+
+def merge(snapshots):
+    # Sums the same metric across processes
+    merged = {}
+    for s in snapshots:
+        for name, metric in s.items():
+            if name not in merged:
+                merged[name] = dict(metric, values={})
+            values = merged[name]['values']
+            for labels, value in metric['values'].items():
+                if labels not in values:
+                    values[labels] = value
+                elif metric['type'] == 'histogram':
+                    values[labels] = [a + b for a, b in zip(values[labels], value)]
+                else:
+                    values[labels] = values[labels] + value
+    return merged
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if len(pairs) == 0:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in pairs)
+
+def render(merged):
+    lines = []
+    for name in sorted(merged):
+        metric = merged[name]
+        lines.append('# HELP %s %s' % (name, metric['help']))
+        lines.append('# TYPE %s %s' % (name, metric['type']))
+        for labels, value in sorted(metric['values'].items()):
+            if metric['type'] != 'histogram':
+                lines.append('%s%s %s' % (name, format_labels(metric['labelnames'], labels), repr(float(value))))
+                continue
+            cumulative = 0
+            for bound, count in zip(metric['buckets'] + ('+Inf',), value[:-1]):
+                cumulative += count
+                lines.append('%s_bucket%s %d' % (
+                    name, format_labels(metric['labelnames'], labels, [('le', bound)]), cumulative))
+            lines.append('%s_sum%s %s' % (name, format_labels(metric['labelnames'], labels), repr(float(value[-1]))))
+            lines.append('%s_count%s %d' % (name, format_labels(metric['labelnames'], labels), cumulative))
+    return '\n'.join(lines) + '\n'
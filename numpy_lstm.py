@@ -0,0 +1,201 @@
+# Runs the trained encoder/decoder with plain NumPy so serving skips Keras predict on every token
+# Weights come from seq2seq.export_numpy_weights, nothing here imports TensorFlow
+import os.path
+import numpy as np
+
+def hard_sigmoid(x):
+    return np.clip(0.2 * x + 0.5, 0., 1.)
+
+def sigmoid(x):
+    return 1. / (1. + np.exp(-x))
+
+activations = {
+    'hard_sigmoid': hard_sigmoid,
+    'sigmoid': sigmoid,
+    'tanh': np.tanh
+}
+
+precisions = ['float32', 'float16', 'int8']
+# Weights that are stored in reduced precision, the biases stay float32
+quantized_keys = [
+    'encoder_embedding',
+    'encoder_kernel',
+    'encoder_recurrent_kernel',
+    'decoder_embedding',
+    'decoder_kernel',
+    'decoder_recurrent_kernel',
+    'dense_kernel'
+]
+# Columns of a reduced precision kernel converted to float32 at once, bounds the temporary memory
+dot_block = 4096
+# Shortlists holding more than this share of the target vocab run the full softmax instead
+shortlist_max_share = 0.5
+
+def quantize(weights, precision):
+    # int8 keeps one float32 scale per embedding row and per kernel output column
+    if precision not in precisions:
+        raise ValueError("Unknown precision: %s" % precision)
+    quantized = dict(weights)
+    quantized['precision'] = precision
+    if precision == 'float32':
+        return quantized
+    for key in quantized_keys:
+        w = np.asarray(weights[key], dtype='float32')
+        if precision == 'float16':
+            quantized[key] = w.astype('float16')
+            continue
+        scale = np.abs(w).max(axis=1 if key.endswith('embedding') else 0, keepdims=True) / 127.
+        scale[scale == 0] = 1.
+        quantized[key] = np.round(w / scale).astype('int8')
+        quantized[key + '_scale'] = scale.astype('float32')
+    return quantized
+
+def quantized_path(filename, precision):
+    return os.path.splitext(filename)[0] + '-%s.npz' % precision
+
+def softmax(x):
+    e = np.exp(x - x.max(axis=-1, keepdims=True))
+    return e / e.sum(axis=-1, keepdims=True)
+
+class NumpySeq2Seq(object):
+    def __init__(self, filename, max_batch_size=16, precision=None, shortlist=None, shortlist_confidence=0.1):
+        # A float32 file is quantized on load when precision asks for less, files written by
+        # quantize.py are used as they are
+        # shortlist is an .npz from shortlist.py: the steps after an encode only score the candidate
+        # words of its inputs, rows whose best candidate is below shortlist_confidence run the full softmax
+        weights = dict(np.load(filename))
+        self.precision = str(weights.get('precision', 'float32'))
+        if precision is not None and precision != self.precision and self.precision == 'float32':
+            weights = quantize(weights, precision)
+            self.precision = precision
+        self.weights = weights
+        self.encoder_bias = weights['encoder_bias']
+        self.decoder_bias = weights['decoder_bias']
+        self.dense_bias = weights['dense_bias']
+        self.activation = activations[str(weights['activation'])]
+        self.recurrent_activation = activations[str(weights['recurrent_activation'])]
+        self.latent_dim = weights['encoder_recurrent_kernel'].shape[0]
+        self.shortlist = dict(np.load(shortlist)) if shortlist is not None else None
+        self.shortlist_confidence = shortlist_confidence
+        self.reset_shortlist_stats()
+        self._candidates = None
+
+        # Gate buffers are reused between steps, batches smaller than max_batch_size use a slice
+        self.max_batch_size = max_batch_size
+        self._z = np.zeros((max_batch_size, 4 * self.latent_dim), dtype='float32')
+        self._zr = np.zeros((max_batch_size, 4 * self.latent_dim), dtype='float32')
+
+    def reset_shortlist_stats(self):
+        # Rows and batches decoded with the shortlist, and how many of them used the full softmax
+        self.shortlist_stats = {'rows': 0, 'fallback_rows': 0, 'candidates': 0, 'batches': 0, 'full_batches': 0}
+
+    def _buffers(self, n):
+        if n > self.max_batch_size:
+            self.max_batch_size = n
+            self._z = np.zeros((n, 4 * self.latent_dim), dtype='float32')
+            self._zr = np.zeros((n, 4 * self.latent_dim), dtype='float32')
+        return (self._z[:n], self._zr[:n])
+
+    def nbytes(self):
+        return sum(np.asarray(w).nbytes for w in self.weights.values())
+
+    def _rows(self, key, ids):
+        # Embedding lookup, only the rows looked up are converted back to float32
+        rows = self.weights[key][ids]
+        if rows.dtype == np.float32:
+            return rows
+        rows = rows.astype('float32')
+        if key + '_scale' in self.weights:
+            rows *= self.weights[key + '_scale'][ids]
+        return rows
+
+    def _dot(self, x, key):
+        w = self.weights[key]
+        if w.dtype == np.float32:
+            return np.dot(x, w)
+        scale = self.weights.get(key + '_scale')
+        out = np.empty(x.shape[:-1] + (w.shape[1],), dtype='float32')
+        for j in range(0, w.shape[1], dot_block):
+            out[..., j:j+dot_block] = np.dot(x, w[:, j:j+dot_block].astype('float32'))
+            if scale is not None:
+                out[..., j:j+dot_block] *= scale[0, j:j+dot_block]
+        return out
+
+    def _cell(self, x_kernel, h, c, recurrent_kernel, bias):
+        # Same gate layout as keras.layers.LSTM: input, forget, cell, output
+        z, zr = self._buffers(len(h))
+        if self.weights[recurrent_kernel].dtype == np.float32:
+            np.dot(h, self.weights[recurrent_kernel], out=zr)
+        else:
+            zr[:] = self._dot(h, recurrent_kernel)
+        np.add(x_kernel, zr, out=z)
+        z += bias
+        u = self.latent_dim
+        i = self.recurrent_activation(z[:, :u])
+        f = self.recurrent_activation(z[:, u:2*u])
+        o = self.recurrent_activation(z[:, 3*u:])
+        c = f * c + i * self.activation(z[:, 2*u:3*u])
+        h = o * self.activation(c)
+        return (h, c)
+
+    def encode(self, input_seqs, initial_state=None):
+        # initial_state is an [h, c] to start from instead of zeros
+        n, length = input_seqs.shape
+        # One matmul for the input projection of every timestep
+        x_kernel = self._dot(self._rows('encoder_embedding', input_seqs), 'encoder_kernel')
+        if initial_state is None:
+            h = np.zeros((n, self.latent_dim), dtype='float32')
+            c = np.zeros((n, self.latent_dim), dtype='float32')
+        else:
+            h = np.asarray(initial_state[0], dtype='float32')
+            c = np.asarray(initial_state[1], dtype='float32')
+        for t in range(length):
+            mask = (input_seqs[:, t] != 0)[:, None]
+            if not mask.any():
+                continue
+            h_t, c_t = self._cell(x_kernel[:, t], h, c, 'encoder_recurrent_kernel', self.encoder_bias)
+            # Padding keeps the previous state, like the masked Keras layer
+            h = np.where(mask, h_t, h)
+            c = np.where(mask, c_t, c)
+        self._candidates = self._shortlist(input_seqs)
+        return [h, c]
+
+    def _shortlist(self, input_seqs):
+        # (candidate ids, their softmax kernel columns in float32, their biases) for the steps after an encode
+        if self.shortlist is None:
+            return None
+        import shortlist
+        ids = shortlist.candidates(self.shortlist, input_seqs)
+        self.shortlist_stats['candidates'] += len(ids)
+        self.shortlist_stats['batches'] += 1
+        if len(ids) > shortlist_max_share * len(self.dense_bias):
+            self.shortlist_stats['full_batches'] += 1
+            return None
+        kernel = self.weights['dense_kernel'][:, ids].astype('float32')
+        if 'dense_kernel_scale' in self.weights:
+            kernel *= self.weights['dense_kernel_scale'][:, ids]
+        return (ids, kernel, self.dense_bias[ids])
+
+    def _shortlist_softmax(self, output):
+        ids, kernel, bias = self._candidates
+        shortlisted = softmax(np.dot(output, kernel) + bias)
+        probabilities = np.zeros((len(output), len(self.dense_bias)), dtype='float32')
+        probabilities[:, ids] = shortlisted
+        unsure = shortlisted.max(axis=-1) < self.shortlist_confidence
+        if unsure.any():
+            probabilities[unsure] = softmax(self._dot(output[unsure], 'dense_kernel') + self.dense_bias)
+        self.shortlist_stats['rows'] += len(output)
+        self.shortlist_stats['fallback_rows'] += int(unsure.sum())
+        return probabilities
+
+    def step(self, target_seq, h, c):
+        tokens = target_seq[:, -1]
+        x_kernel = self._dot(self._rows('decoder_embedding', tokens), 'decoder_kernel')
+        h_t, c_t = self._cell(x_kernel, h, c, 'decoder_recurrent_kernel', self.decoder_bias)
+        mask = (tokens != 0)[:, None]
+        output = np.where(mask, h_t, 0.)
+        if self._candidates is None:
+            probabilities = softmax(self._dot(output, 'dense_kernel') + self.dense_bias)
+        else:
+            probabilities = self._shortlist_softmax(output)
+        return (probabilities, np.where(mask, h_t, h), np.where(mask, c_t, c))
@@ -0,0 +1,121 @@
+# Converts a trained checkpoint to reduced precision weights for the NumPy serving backend and
+# reports how often the converted model picks the same next token as the float32 one
+# Usage: python quantize.py <model/bot-*.h5 or exported .npz> [--precision int8|float16] [--pairs N]
+# Writes <checkpoint>-<precision>.npz next to the checkpoint, serving.py picks it up with precision = int8
+# The report teacher-forces both models on the float32 greedy replies of up to N of the pairs
+# bot.py holds out for validation
+from __future__ import print_function
+from collections import deque
+import configparser
+import os
+import os.path
+import sys
+import numpy as np
+import bundle
+import cli
+import corpus
+import numpy_lstm
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+config = configparser.ConfigParser()
+config.read(os.path.join(here, 'config.ini'))
+bundle_file = config['DEFAULT'].get('bundle', 'model/bundle.json')
+# Same share of the training pairs as bot.py keeps for validation
+validation_split = 0.05
+
+def export_checkpoint(checkpoint, model_bundle):
+    # Float32 .npz of an .h5 checkpoint, bot.py already leaves one next to the models it trains
+    numpy_weights = os.path.splitext(checkpoint)[0] + '.npz'
+    if not os.path.isfile(numpy_weights):
+        import seq2seq
+        model, encoder_model, decoder_model = seq2seq.build_models(
+            len(model_bundle['input_vocab']), len(model_bundle['target_vocab']),
+            model_bundle['latent_dim'], model_bundle['embedding_dim'])
+        model.load_weights(checkpoint)
+        seq2seq.export_numpy_weights(encoder_model, decoder_model, numpy_weights)
+    return numpy_weights
+
+def held_out_inputs(model_bundle, num_pairs):
+    # The last num_pairs of bot.py's validation pairs, the tail of the pairs it trains on
+    section = config['DEFAULT']
+    training_files = [os.path.join(here, section['data_path'] + name) for name in section['data'].split(',')]
+    num_samples = int(section['num_samples'])
+    # Only the tail that can be held out is kept while reading
+    pairs = deque(maxlen=max(1, int(num_samples * validation_split)))
+    count = 0
+    for pair in corpus.training_pairs(training_files, num_samples, *corpus.sampling_settings(section)):
+        pairs.append(pair)
+        count += 1
+    held_out = max(1, int(count * validation_split))
+    pairs = list(pairs)[-min(held_out, num_pairs):]
+    texts = [corpus.prepare_pair(a, b, model_bundle['max_seq_len'])[0] for a, b in pairs]
+    return corpus.vectorize(texts, model_bundle['input_token_index'], model_bundle['max_encoder_seq_length'])
+
+def agreement(reference, quantized, input_seqs, go_index, eos_index, max_len):
+    # (top-1 agreement per token, share of identical greedy replies, largest probability difference)
+    n = len(input_seqs)
+    h, c = reference.encode(input_seqs)
+    hq, cq = quantized.encode(input_seqs)
+    hg, cg = hq, cq
+    target_seq = np.full((n, 1), go_index, dtype='int32')
+    free_seq = target_seq.copy()
+    active = np.ones(n, dtype=bool)
+    free_active = np.ones(n, dtype=bool)
+    replies = np.zeros((n, max_len), dtype='int32')
+    free_replies = np.zeros((n, max_len), dtype='int32')
+    agree = total = 0
+    max_diff = 0.
+    for t in range(max_len):
+        probabilities, h, c = reference.step(target_seq, h, c)
+        quantized_probabilities, hq, cq = quantized.step(target_seq, hq, cq)
+        tokens = probabilities.argmax(axis=-1)
+        agree += int((tokens == quantized_probabilities.argmax(axis=-1))[active].sum())
+        total += int(active.sum())
+        if active.any():
+            max_diff = max(max_diff, float(np.abs(probabilities - quantized_probabilities)[active].max()))
+
+        # The quantized model decoding on its own, for the whole reply comparison
+        free_probabilities, hg, cg = quantized.step(free_seq, hg, cg)
+        free_tokens = free_probabilities.argmax(axis=-1)
+
+        # Finished rows are fed padding, which keeps their state and outputs nothing
+        tokens = np.where(active, tokens, 0)
+        free_tokens = np.where(free_active, free_tokens, 0)
+        replies[:, t] = tokens
+        free_replies[:, t] = free_tokens
+        active &= tokens != eos_index
+        free_active &= free_tokens != eos_index
+        target_seq = tokens.reshape(-1, 1).astype('int32')
+        free_seq = free_tokens.reshape(-1, 1).astype('int32')
+        if not active.any() and not free_active.any():
+            break
+    return (agree / float(max(total, 1)), float((replies == free_replies).all(axis=1).mean()), max_diff)
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    precision = cli.option(args, '--precision', 'int8')
+    num_pairs = int(cli.option(args, '--pairs', 500))
+    if len(args) != 1 or precision not in numpy_lstm.precisions[1:]:
+        sys.exit("Usage: python quantize.py <checkpoint .h5 or .npz> [--precision int8|float16] [--pairs N]")
+
+    model_bundle = bundle.load_bundle(bundle_file)
+    checkpoint = os.path.abspath(args[0])
+    numpy_weights = checkpoint if checkpoint.endswith('.npz') else export_checkpoint(checkpoint, model_bundle)
+
+    output = numpy_lstm.quantized_path(numpy_weights, precision)
+    np.savez(output, **numpy_lstm.quantize(dict(np.load(numpy_weights)), precision))
+    print("Wrote", output)
+
+    reference = numpy_lstm.NumpySeq2Seq(numpy_weights, num_pairs)
+    quantized = numpy_lstm.NumpySeq2Seq(output, num_pairs)
+    print("Weights: float32 %.1fMB, %s %.1fMB" % (
+        reference.nbytes() / 1048576., precision, quantized.nbytes() / 1048576.))
+    input_seqs = held_out_inputs(model_bundle, num_pairs)
+    token_agreement, reply_agreement, max_diff = agreement(
+        reference, quantized, input_seqs, model_bundle['target_token_index']["<GO>"],
+        model_bundle['target_token_index']["<EOS>"], model_bundle['max_seq_len'])
+    print("Held out pairs: %d" % len(input_seqs))
+    print("Top-1 agreement per token: %.2f%%" % (100 * token_agreement))
+    print("Identical greedy replies: %.2f%%" % (100 * reply_agreement))
+    print("Largest probability difference: %.5f" % max_diff)
@@ -0,0 +1,76 @@
+# On-disk replay buffer of live conversations for online fine-tuning by trainer.py
+# flaskapp.py appends every (message, reply) pair posted to /api/learn to a text file, trainer.py
+# turns only the lines added since its last run into token ids against the frozen bundle vocab and
+# appends them to a token corpus (see token_corpus.py), then trains on those plus a sample of older ones
+from io import open
+import configparser
+import os
+import os.path
+import numpy as np
+import corpus
+import token_corpus
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+config = configparser.ConfigParser()
+config.read(os.path.join(here, 'config.ini'))
+replay_path = os.path.join(here, config['DEFAULT'].get('replay_buffer', 'model/replay'))
+incoming_file = os.path.join(replay_path, 'incoming.train')
+
+def clean(text):
+    # One pair per line, in the format of the training files
+    return " ".join(text.replace(corpus.separator, " ").split())
+
+def record(message, reply):
+    message = clean(message)
+    reply = clean(reply)
+    if not message or not reply:
+        raise ValueError("Both a message and a reply are needed")
+    if not os.path.isdir(replay_path):
+        os.makedirs(replay_path)
+    # A single short write to a file opened for appending does not interleave with other processes
+    with open(incoming_file, 'a', encoding='utf-8') as f:
+        f.write(message + " " + corpus.separator + " " + reply + "\n")
+
+def new_lines(offset):
+    # (pairs after byte offset, offset after the last complete line), a line still being written is left for later
+    if not os.path.isfile(incoming_file):
+        return ([], offset)
+    pairs = []
+    with open(incoming_file, 'rb') as f:
+        f.seek(offset)
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            offset += len(line)
+            pair = corpus.split_pair(line.decode('utf-8').rstrip("\n"))
+            if pair is not None:
+                pairs.append(pair)
+    return (pairs, offset)
+
+def ingest(model_bundle):
+    # Appends the pairs recorded since the last call and returns the header of the buffer
+    # A bundle with another vocab makes the old ids meaningless, the buffer is then rebuilt from every line
+    corpus_path = os.path.join(replay_path, 'corpus')
+    header = token_corpus.load_header(corpus_path)
+    if header is None or header['input_vocab'] != model_bundle['input_vocab'] or \
+            header['target_vocab'] != model_bundle['target_vocab']:
+        header = token_corpus.write_token_corpus(
+            corpus_path, [], model_bundle['input_token_index'], model_bundle['target_token_index'],
+            model_bundle['max_seq_len'], model_bundle['max_encoder_seq_length'],
+            model_bundle['max_decoder_seq_length'], None, [])
+    pairs, offset = new_lines(header.get('incoming_offset', 0))
+    header = token_corpus.append_token_corpus(
+        corpus_path, corpus.tokenize_pairs(pairs, model_bundle['max_seq_len']), header,
+        {'incoming_offset': offset})
+    return header
+
+def mix(start, end, replay_ratio, rng=None):
+    # Indices of the new pairs start to end plus replay_ratio older pairs for each of them,
+    # so a run costs the same however long the buffer has grown
+    if rng is None:
+        rng = np.random
+    fresh = np.arange(start, end)
+    # Drawn with replacement, sampling without it would shuffle the whole buffer
+    replayed = rng.randint(0, start, size=int(replay_ratio * len(fresh))) if start > 0 else np.zeros(0, dtype='int64')
+    return np.concatenate([fresh, replayed])
@@ -0,0 +1,85 @@
+# In-process LRU cache of decoded replies keyed on the normalized input and the decoding settings
+import random
+import threading
+import time
+from collections import OrderedDict
+
+class ResponseCache(object):
+    def __init__(self, max_size=1024, ttl=600, replies_per_key=1):
+        # max_size of 0 turns the cache off, ttl is in seconds (0 never expires)
+        self.max_size = max_size
+        self.ttl = ttl
+        self.replies_per_key = replies_per_key
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.version = None
+
+    def get(self, key):
+        # A key only hits once it holds all of its replies, until then every
+        # request decodes a fresh reply so the stored answers stay varied
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and self.ttl > 0 and time.time() - entry[0] > self.ttl:
+                del self.entries[key]
+                self.evictions += 1
+                entry = None
+            if entry is None or len(entry[2]) < entry[1]:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return random.choice(entry[2])
+
+    def put(self, key, reply, replies_per_key=None, version=None):
+        # version is the one read before decoding, a reply of weights swapped out since is dropped
+        if self.max_size <= 0:
+            return
+        with self.lock:
+            if version is not None and version != self.version:
+                return
+            entry = self.entries.get(key)
+            if entry is None:
+                entry = (time.time(), replies_per_key or self.replies_per_key, [])
+                self.entries[key] = entry
+            if len(entry[2]) < entry[1]:
+                entry[2].append(reply)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def set_version(self, version):
+        # Replies from other model weights are dropped
+        with self.lock:
+            if version != self.version:
+                self.entries.clear()
+                self.version = version
+
+    def stats(self):
+        with self.lock:
+            return {
+                'size': len(self.entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'version': self.version
+            }
+
+def merge_stats(stats):
+    # Sums the stats of several processes, values that are not counts are kept when they all agree
+    merged = {}
+    for s in stats:
+        for k, v in s.items():
+            if k not in merged:
+                merged[k] = v
+            elif isinstance(v, dict):
+                merged[k] = merge_stats([merged[k], v])
+            elif isinstance(v, (int, float)) and not isinstance(v, bool):
+                merged[k] += v
+            elif merged[k] != v:
+                merged[k] = None
+    return merged
@@ -0,0 +1,122 @@
+# Decoding strategies, every function works on a (batch, vocab) array of probabilities
+import numpy as np
+
+strategies = ['greedy', 'temperature', 'top_k', 'nucleus', 'beam']
+
+def apply_temperature(probabilities, temperature=1.0):
+    if temperature != 1.0:
+        probabilities = probabilities ** (1. / temperature)
+    return probabilities / probabilities.sum(axis=-1, keepdims=True)
+
+def draw(probabilities, rng):
+    # One inverse CDF draw per row, rows do not have to be normalized
+    cdf = np.cumsum(probabilities, axis=-1)
+    u = rng.random_sample((len(cdf), 1)) * cdf[:, -1:]
+    return np.minimum((cdf <= u).sum(axis=-1), probabilities.shape[-1] - 1)
+
+def greedy(probabilities, rng=None):
+    return probabilities.argmax(axis=-1)
+
+def temperature_sample(probabilities, rng, temperature=1.0):
+    return draw(apply_temperature(probabilities, temperature), rng)
+
+def top_k(probabilities, rng, k=16, temperature=1.0):
+    # argpartition finds the k best tokens without sorting the whole vocab
+    n, vocab = probabilities.shape
+    k = max(1, min(k, vocab))
+    top = np.argpartition(probabilities, vocab - k, axis=-1)[:, vocab-k:]
+    top_probabilities = np.take_along_axis(probabilities, top, axis=-1)
+    choice = draw(apply_temperature(top_probabilities, temperature), rng)
+    return top[np.arange(n), choice]
+
+def nucleus(probabilities, rng, p=0.9, temperature=1.0):
+    # Samples from the smallest set of tokens holding at least p of the probability mass
+    n = len(probabilities)
+    probabilities = apply_temperature(probabilities, temperature)
+    order = np.argsort(-probabilities, axis=-1)
+    sorted_probabilities = np.take_along_axis(probabilities, order, axis=-1)
+    before = np.cumsum(sorted_probabilities, axis=-1) - sorted_probabilities
+    choice = draw(np.where(before < p, sorted_probabilities, 0.), rng)
+    return order[np.arange(n), choice]
+
+def beam_search(encode, step, input_seq, go_index, eos_index, max_len, beam_width=4, return_state=False):
+    # Keeps the beam_width best partial replies, each step scores all of them
+    # against the whole vocab as one (beam, vocab) array
+    # With return_state it returns (reply, [h, c] of the decoder after the reply)
+    h, c = encode(input_seq)
+    target_seq = np.array([[go_index]], dtype='int32')
+    scores = np.zeros(1)
+    beams = [[]]
+    finished = []
+    for t in range(max_len):
+        probabilities, h, c = step(target_seq, h, c)
+        vocab = probabilities.shape[-1]
+        log_probabilities = (scores[:, None] + np.log(probabilities + 1e-12)).ravel()
+
+        width = beam_width - len(finished)
+        top = np.argpartition(-log_probabilities, width - 1)[:width]
+        top = top[np.argsort(-log_probabilities[top])]
+        rows, tokens = np.divmod(top, vocab)
+
+        alive = []
+        for i, (row, token) in enumerate(zip(rows, tokens)):
+            beam = beams[row] + [int(token)]
+            if token == eos_index:
+                finished.append((log_probabilities[top[i]] / len(beam), beam, h[row:row+1], c[row:row+1]))
+            else:
+                alive.append(i)
+        if len(alive) == 0 or len(finished) >= beam_width:
+            break
+
+        beams = [beams[rows[i]] + [int(tokens[i])] for i in alive]
+        scores = log_probabilities[top[alive]]
+        h = h[rows[alive]]
+        c = c[rows[alive]]
+        target_seq = tokens[alive].reshape(-1, 1).astype('int32')
+    else:
+        finished += [(scores[i] / len(beam), beam, h[i:i+1], c[i:i+1]) for i, beam in enumerate(beams)]
+
+    # Scores are averaged per token so long replies are not penalized
+    best = max(finished, key=lambda f: f[0])
+    if return_state:
+        return (best[1], [best[2], best[3]])
+    return best[1]
+
+class Sampler(object):
+    def __init__(self, strategy='top_k', temperature=1.0, k=16, p=0.9, beam_width=4, seed=None):
+        if strategy not in strategies:
+            raise ValueError("Unknown decoding strategy: %s" % strategy)
+        # Checked here so a bad request is refused before it reaches the decode batch
+        if temperature <= 0:
+            raise ValueError("temperature must be above 0")
+        if k < 1:
+            raise ValueError("k must be at least 1")
+        if not 0 < p <= 1:
+            raise ValueError("p must be above 0 and at most 1")
+        if beam_width < 1:
+            raise ValueError("beam_width must be at least 1")
+        self.strategy = strategy
+        self.temperature = temperature
+        self.k = k
+        self.p = p
+        self.beam_width = beam_width
+        self.seed = seed
+        self.rng = np.random.RandomState(seed)
+
+    def settings(self):
+        return (self.strategy, self.temperature, self.k, self.p, self.beam_width, self.seed)
+
+    def is_deterministic(self):
+        # Same input, same reply
+        return self.strategy == 'greedy' or self.strategy == 'beam' or self.seed is not None
+
+    def __call__(self, probabilities):
+        # Returns one token index per row
+        probabilities = np.asarray(probabilities, dtype='float64')
+        if self.strategy == 'greedy' or self.strategy == 'beam':
+            return greedy(probabilities)
+        if self.strategy == 'temperature':
+            return temperature_sample(probabilities, self.rng, self.temperature)
+        if self.strategy == 'nucleus':
+            return nucleus(probabilities, self.rng, self.p, self.temperature)
+        return top_k(probabilities, self.rng, self.k, self.temperature)
@@ -0,0 +1,154 @@
+# The encoder/decoder network shared by training (bot.py) and serving (flaskapp.py)
+import numpy as np
+from keras import backend as K
+from keras.models import Model
+from keras.layers import Input, Embedding, LSTM, Dense, Layer
+
+class SoftmaxWeights(Layer):
+    # Hands the decoder outputs through unchanged but carries the weights of the softmax layer, so
+    # the training model updates them although only the sampled softmax loss projects onto the vocab
+    def __init__(self, dense, **kwargs):
+        super(SoftmaxWeights, self).__init__(**kwargs)
+        self.dense = dense
+        self.supports_masking = True
+
+    @property
+    def trainable_weights(self):
+        return self.dense.trainable_weights
+
+    @property
+    def non_trainable_weights(self):
+        return []
+
+    def call(self, inputs):
+        # Marks the output as depending on the learning phase, Keras then feeds it to the loss
+        return K.in_train_phase(inputs, K.identity(inputs))
+
+def sampled_softmax_loss(dense, num_sampled, unigrams=None):
+    # Softmax over the target word and num_sampled sampled words while training, drawn by the
+    # unigrams frequencies when given (the vocab is ordered by POS tag, not by frequency) or
+    # uniformly. Validation runs the full softmax so val_loss compares with full softmax training
+    import tensorflow as tf
+    num_classes = dense.units
+
+    def loss(y_true, y_pred):
+        labels = K.reshape(K.cast(y_true, 'int64'), (-1, 1))
+        inputs = K.reshape(y_pred, (-1, K.int_shape(y_pred)[-1]))
+
+        def sampled():
+            if unigrams is None:
+                sampled_values = tf.nn.uniform_candidate_sampler(labels, 1, num_sampled, True, num_classes)
+            else:
+                sampled_values = tf.nn.fixed_unigram_candidate_sampler(
+                    labels, 1, num_sampled, True, num_classes, distortion=0.75, unigrams=list(unigrams))
+            return tf.nn.sampled_softmax_loss(
+                tf.transpose(dense.kernel), dense.bias, labels, inputs, num_sampled, num_classes,
+                sampled_values=sampled_values)
+
+        def full():
+            return tf.nn.sparse_softmax_cross_entropy_with_logits(
+                labels=labels[:, 0], logits=K.bias_add(K.dot(inputs, dense.kernel), dense.bias))
+
+        # Only the branch of the current phase runs
+        return K.reshape(K.in_train_phase(sampled, full), K.shape(y_true)[:-1])
+    return loss
+
+def build_models(num_encoder_tokens, num_decoder_tokens, latent_dim, embedding_dim, num_sampled=0, unigrams=None):
+    # Returns the training model and the encoder/decoder inference models, all sharing the same layers
+    # With num_sampled the training model outputs the decoder states and learns through
+    # sampled_softmax_loss, the inference models always run the full softmax
+    encoder_inputs = Input(shape=(None,))
+    encoder_embedding = Embedding(num_encoder_tokens, embedding_dim, mask_zero=True)
+    encoder = LSTM(latent_dim, return_state=True)
+    encoder_outputs, state_h, state_c = encoder(encoder_embedding(encoder_inputs))
+    encoder_states = [state_h, state_c]
+
+    decoder_inputs = Input(shape=(None,))
+    decoder_embedding = Embedding(num_decoder_tokens, embedding_dim, mask_zero=True)
+    decoder_lstm = LSTM(latent_dim, return_sequences=True, return_state=True)
+    decoder_outputs, _, _, = decoder_lstm(decoder_embedding(decoder_inputs), initial_state=encoder_states)
+    decoder_dense = Dense(num_decoder_tokens, activation='softmax')
+    if num_sampled > 0:
+        model = Model([encoder_inputs, decoder_inputs], SoftmaxWeights(decoder_dense)(decoder_outputs))
+    else:
+        model = Model([encoder_inputs, decoder_inputs], decoder_dense(decoder_outputs))
+
+    encoder_model = Model(encoder_inputs, encoder_states)
+
+    decoder_state_input_h = Input(shape=(latent_dim,))
+    decoder_state_input_c = Input(shape=(latent_dim,))
+    decoder_states_inputs = [decoder_state_input_h, decoder_state_input_c]
+    decoder_outputs, state_h, state_c = decoder_lstm(
+        decoder_embedding(decoder_inputs), initial_state=decoder_states_inputs
+    )
+    decoder_states = [state_h, state_c]
+    decoder_outputs = decoder_dense(decoder_outputs)
+    decoder_model = Model(
+        [decoder_inputs] + decoder_states_inputs,
+        [decoder_outputs] + decoder_states
+    )
+
+    if num_sampled > 0:
+        # The decoder model built the softmax kernel the loss needs, accuracy would need the full softmax
+        model.compile(optimizer='adam', loss=sampled_softmax_loss(decoder_dense, num_sampled, unigrams))
+    else:
+        # Targets are token ids rather than one-hot vectors
+        model.compile(optimizer='adam', loss='sparse_categorical_crossentropy', metrics=['accuracy'])
+
+    return (model, encoder_model, decoder_model)
+
+def find_layers(encoder_model, decoder_model):
+    return (
+        [l for l in encoder_model.layers if isinstance(l, Embedding)][0],
+        [l for l in encoder_model.layers if isinstance(l, LSTM)][0],
+        [l for l in decoder_model.layers if isinstance(l, Embedding)][0],
+        [l for l in decoder_model.layers if isinstance(l, LSTM)][0],
+        [l for l in decoder_model.layers if isinstance(l, Dense)][0]
+    )
+
+def build_state_encoder(encoder_model):
+    # Encoder that starts from a given [h, c] instead of zeros, so a conversation can carry its
+    # state into the next message. Shares its layers with encoder_model
+    encoder_embedding = [l for l in encoder_model.layers if isinstance(l, Embedding)][0]
+    encoder = [l for l in encoder_model.layers if isinstance(l, LSTM)][0]
+    encoder_inputs = Input(shape=(None,))
+    state_input_h = Input(shape=(encoder.units,))
+    state_input_c = Input(shape=(encoder.units,))
+    _, state_h, state_c = encoder(encoder_embedding(encoder_inputs), initial_state=[state_input_h, state_input_c])
+    return Model([encoder_inputs, state_input_h, state_input_c], [state_h, state_c])
+
+def export_numpy_weights(encoder_model, decoder_model, filename):
+    # Dumps the weights in the layout numpy_lstm.NumpySeq2Seq expects
+    encoder_embedding, encoder, decoder_embedding, decoder_lstm, decoder_dense = find_layers(
+        encoder_model, decoder_model)
+
+    encoder_kernel, encoder_recurrent_kernel, encoder_bias = encoder.get_weights()
+    decoder_kernel, decoder_recurrent_kernel, decoder_bias = decoder_lstm.get_weights()
+    dense_kernel, dense_bias = decoder_dense.get_weights()
+    lstm_config = decoder_lstm.get_config()
+    np.savez(
+        filename,
+        encoder_embedding=encoder_embedding.get_weights()[0],
+        encoder_kernel=encoder_kernel,
+        encoder_recurrent_kernel=encoder_recurrent_kernel,
+        encoder_bias=encoder_bias,
+        decoder_embedding=decoder_embedding.get_weights()[0],
+        decoder_kernel=decoder_kernel,
+        decoder_recurrent_kernel=decoder_recurrent_kernel,
+        decoder_bias=decoder_bias,
+        dense_kernel=dense_kernel,
+        dense_bias=dense_bias,
+        activation=lstm_config['activation'],
+        recurrent_activation=lstm_config['recurrent_activation']
+    )
+
+def import_numpy_weights(encoder_model, decoder_model, weights):
+    # Inverse of export_numpy_weights, sets the layers from an already loaded .npz
+    encoder_embedding, encoder, decoder_embedding, decoder_lstm, decoder_dense = find_layers(
+        encoder_model, decoder_model)
+
+    encoder_embedding.set_weights([weights['encoder_embedding']])
+    encoder.set_weights([weights['encoder_kernel'], weights['encoder_recurrent_kernel'], weights['encoder_bias']])
+    decoder_embedding.set_weights([weights['decoder_embedding']])
+    decoder_lstm.set_weights([weights['decoder_kernel'], weights['decoder_recurrent_kernel'], weights['decoder_bias']])
+    decoder_dense.set_weights([weights['dense_kernel'], weights['dense_bias']])
@@ -0,0 +1,322 @@
+# Loads the model from the serving bundle and turns sentences into replies
+# flaskapp.py imports this directly, or every worker process of workers.WorkerPool does
+import json
+import os.path
+import threading
+import time
+from configparser import ConfigParser
+import batcher
+import bundle
+import corpus
+import metrics
+import response_cache
+import sampling
+import sessions
+import vocabulary
+import numpy as np
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+tokenizer = corpus.tokenizer
+blacklist_pattern = r'http://[a-z]*'
+
+# Serving only needs the bundle written by bot.py, not the training corpus
+config = ConfigParser()
+config.read(os.path.join(here, 'config.ini'))
+bundle_file = config['DEFAULT'].get('bundle', 'model/bundle.json')
+# Requests arriving within batch_window milliseconds are decoded together, up to max_batch_size
+batch_window = float(config['DEFAULT'].get('batch_window', 10)) / 1000
+max_batch_size = int(config['DEFAULT'].get('max_batch_size', 16))
+# keras runs predict on the trained models, numpy runs the exported weights without TensorFlow
+backend = config['DEFAULT'].get('backend', 'keras')
+# float16 or int8 weights for the numpy backend, from quantize.py or converted on load
+precision = config['DEFAULT'].get('precision', 'float32')
+# The numpy backend only scores the shortlist of candidate words bot.py wrote next to the bundle,
+# falling back to the whole vocab for replies whose best candidate is below shortlist_confidence
+use_shortlist = config['DEFAULT'].getboolean('shortlist', False)
+shortlist_confidence = float(config['DEFAULT'].get('shortlist_confidence', 0.1))
+# Default decoding, /api can override each of these with a query parameter of the same name
+default_strategy = config['DEFAULT'].get('strategy', 'top_k')
+default_temperature = float(config['DEFAULT'].get('temperature', 1.2))
+default_k = int(config['DEFAULT'].get('k', 16))
+default_p = float(config['DEFAULT'].get('p', 0.9))
+default_beam_width = int(config['DEFAULT'].get('beam_width', 4))
+default_seed = config['DEFAULT'].get('seed', None)
+# Replies cached per normalized input, cache_replies keeps several sampled replies per input
+cache_size = int(config['DEFAULT'].get('cache_size', 1024))
+cache_ttl = float(config['DEFAULT'].get('cache_ttl', 600))
+cache_replies = int(config['DEFAULT'].get('cache_replies', 3))
+# Conversations passing a session id carry the decoder state of the last reply into the next message
+# Sessions are dropped after session_ttl idle seconds or when over session_size or session_memory megabytes
+session_size = int(config['DEFAULT'].get('session_size', 10000))
+session_ttl = float(config['DEFAULT'].get('session_ttl', 1800))
+session_memory = float(config['DEFAULT'].get('session_memory', 64))
+# Largest number of sentences chat_batch takes at once
+max_bulk_size = int(config['DEFAULT'].get('max_bulk_size', 256))
+# Seconds between checks of the bundle for weights published by trainer.py, 0 turns hot swapping off
+reload_interval = float(config['DEFAULT'].get('reload_interval', 10))
+
+model_bundle = bundle.load_bundle(bundle_file)
+if 'latent_dim' in config['DEFAULT'] and bundle.config_hash(config['DEFAULT']) != model_bundle['config_hash']:
+    print("Warning: config.ini has changed since", bundle_file, "was built")
+
+input_vocab = vocabulary.Vocabulary(model_bundle['input_vocab'])
+target_vocab = vocabulary.Vocabulary(model_bundle['target_vocab'])
+input_token_index = input_vocab.index
+target_token_index = target_vocab.index
+num_encoder_tokens = len(input_vocab)
+num_decoder_tokens = len(target_vocab)
+max_seq_len = model_bundle['max_seq_len']
+latent_dim = model_bundle['latent_dim']
+embedding_dim = model_bundle['embedding_dim']
+
+def load_engine(b):
+    import numpy_lstm
+    numpy_weights = b['numpy_weights']
+    if precision != 'float32' and os.path.isfile(numpy_lstm.quantized_path(numpy_weights, precision)):
+        numpy_weights = numpy_lstm.quantized_path(numpy_weights, precision)
+    if use_shortlist and b.get('shortlist') is None:
+        print("The bundle has no shortlist, run python shortlist.py --build")
+    return numpy_lstm.NumpySeq2Seq(numpy_weights, max_batch_size, precision,
+                                   b.get('shortlist') if use_shortlist else None, shortlist_confidence)
+
+if backend == 'numpy':
+    engine = load_engine(model_bundle)
+    encode = engine.encode
+    decoder_step = engine.step
+else:
+    import seq2seq
+    if precision != 'float32':
+        print("precision =", precision, "only applies to the numpy backend, serving float32")
+    if use_shortlist:
+        print("shortlist only applies to the numpy backend, serving the full softmax")
+    model, encoder_model, decoder_model = seq2seq.build_models(
+        num_encoder_tokens, num_decoder_tokens, latent_dim, embedding_dim)
+    model.load_weights(model_bundle['weights'])
+    model._make_predict_function()
+    model.summary()
+
+    state_encoder_model = seq2seq.build_state_encoder(encoder_model)
+    encoder_model._make_predict_function()
+    decoder_model._make_predict_function()
+    state_encoder_model._make_predict_function()
+
+    def encode(input_seqs, initial_state=None):
+        if initial_state is None:
+            return encoder_model.predict(input_seqs)
+        return state_encoder_model.predict([input_seqs] + initial_state)
+
+    def decoder_step(target_seq, h, c):
+        output_tokens, h, c = decoder_model.predict([target_seq, h, c])
+        return (output_tokens[:, -1, :], h, c)
+
+def number(args, name, default, cast):
+    # Query strings and JSON bodies alike, a null or a list is as bad a value as a word
+    value = args.get(name, default)
+    try:
+        return cast(value)
+    except (TypeError, ValueError):
+        raise ValueError("%s must be a number, got %s" % (name, json.dumps(value)))
+
+def make_sampler(args):
+    # Decoding can be picked per request, config.ini holds the defaults
+    seed = args.get('seed', default_seed)
+    return sampling.Sampler(
+        args.get('strategy', default_strategy),
+        temperature=number(args, 'temperature', default_temperature, float),
+        k=number(args, 'k', default_k, int),
+        p=number(args, 'p', default_p, float),
+        beam_width=number(args, 'beam_width', default_beam_width, int),
+        seed=number(args, 'seed', default_seed, int) if seed is not None else None
+    )
+
+default_sampler = make_sampler({})
+
+decode_batcher = batcher.DecodeBatcher(
+    encode,
+    decoder_step,
+    default_sampler,
+    target_token_index["<GO>"],
+    target_token_index["<EOS>"],
+    max_seq_len,
+    window=batch_window,
+    max_batch_size=max_batch_size
+)
+
+def token_words(tokens):
+    for sampled_token_index in tokens:
+        if not target_vocab.hidden[sampled_token_index]:
+            yield target_vocab[sampled_token_index]
+
+def decode_sequence(input_seq, sampler=None):
+    return "".join(w + " " for w in target_vocab.decode(decode_batcher.decode(input_seq, sampler)))
+
+def decode_sequence_iter(input_seq, sampler=None):
+    # Yields each word as soon as the decoder samples it
+    return token_words(decode_batcher.decode_iter(input_seq, sampler))
+
+def weights_version(b):
+    return (b['weights'], os.path.getmtime(b['weights']))
+
+reply_cache = response_cache.ResponseCache(cache_size, cache_ttl, cache_replies)
+reply_cache.set_version(weights_version(model_bundle))
+session_store = sessions.SessionStore(session_size, session_ttl, int(session_memory * 1024 * 1024))
+session_store.set_version(weights_version(model_bundle))
+
+def swap_weights(new_bundle):
+    # The new weights are read here, only the cheap swap itself runs on the batcher
+    # thread between two batches so in-flight replies finish on the old weights
+    if new_bundle['input_vocab'] != model_bundle['input_vocab'] or new_bundle['target_vocab'] != model_bundle['target_vocab']:
+        print("Vocabulary of", new_bundle['weights'], "differs, restart the server to serve it")
+        return False
+    if new_bundle.get('numpy_weights') is None:
+        print("No exported weights for", new_bundle['weights'], "restart the server to serve it")
+        return False
+    version = weights_version(new_bundle)
+    if backend == 'numpy':
+        new_engine = load_engine(new_bundle)
+        def swap():
+            decode_batcher.encode = new_engine.encode
+            decode_batcher.step = new_engine.step
+            reply_cache.set_version(version)
+            session_store.set_version(version)
+    else:
+        weights = dict(np.load(new_bundle['numpy_weights']))
+        def swap():
+            seq2seq.import_numpy_weights(encoder_model, decoder_model, weights)
+            reply_cache.set_version(version)
+            session_store.set_version(version)
+    decode_batcher.call_between_batches(swap)
+    print("Serving weights", new_bundle['weights'])
+    return True
+
+def watch_bundle():
+    global model_bundle
+    path = os.path.join(bundle.here, bundle_file)
+    mtime = os.path.getmtime(path)
+    while True:
+        time.sleep(reload_interval)
+        try:
+            if os.path.getmtime(path) == mtime:
+                continue
+            mtime = os.path.getmtime(path)
+            new_bundle = bundle.load_bundle(bundle_file)
+            if swap_weights(new_bundle):
+                model_bundle = new_bundle
+        except Exception as e:
+            print("Could not reload", bundle_file, e)
+
+if reload_interval > 0:
+    watcher = threading.Thread(target=watch_bundle, name='bundle-watcher')
+    watcher.daemon = True
+    watcher.start()
+
+def reply(seq, read_sentence, sampler=None, session=None):
+    # read_sentence is what sentence_to_seq made of the input, so messages that only
+    # differ in case, punctuation spacing, unknown words or extra length share a key
+    # A fresh sampler per request so a seeded default really repeats its reply
+    sampler = sampler or make_sampler({})
+    if session is not None:
+        # Replies in a session depend on the turns before, so they skip the cache
+        chat_requests.inc(labels=('session',))
+        # Read before decoding so a state of weights swapped out meanwhile is not kept
+        version = session_store.version
+        request = decode_batcher.submit(seq, sampler, initial_state=session_store.get(session))
+        out = "".join(w + " " for w in target_vocab.decode(request.result()))
+        session_store.put(session, request.state, version)
+        return out
+    key = (read_sentence,) + sampler.settings()
+    # Read before decoding so a reply of weights swapped out meanwhile is not cached
+    version = reply_cache.version
+    out = reply_cache.get(key)
+    chat_requests.inc(labels=('cache' if out is not None else 'model',))
+    if out is None:
+        out = decode_sequence(seq, sampler)
+        reply_cache.put(key, out, 1 if sampler.is_deterministic() else None, version)
+    return out
+
+def reply_iter(seq, read_sentence, sampler=None, session=None):
+    # Streaming reply(), a cache hit comes out all at once
+    sampler = sampler or make_sampler({})
+    if session is not None:
+        chat_requests.inc(labels=('session',))
+        version = session_store.version
+        request = decode_batcher.submit(seq, sampler, stream=True, initial_state=session_store.get(session))
+        for w in token_words(request.stream_tokens()):
+            yield w
+        session_store.put(session, request.state, version)
+        return
+    key = (read_sentence,) + sampler.settings()
+    version = reply_cache.version
+    out = reply_cache.get(key)
+    chat_requests.inc(labels=('cache' if out is not None else 'model',))
+    if out is not None:
+        for w in out.split():
+            yield w
+        return
+    out = ""
+    for w in decode_sequence_iter(seq, sampler):
+        out += w + " "
+        yield w
+    reply_cache.put(key, out, 1 if sampler.is_deterministic() else None, version)
+
+sentence_to_seq_seconds = metrics.Histogram('reina_sentence_to_seq_seconds', 'Time to tokenize and look up a sentence')
+chat_requests = metrics.Counter('reina_chat_requests_total', 'Chat requests by reply source', ('source',))
+metrics.Gauge('reina_sessions', 'Conversations holding a state', lambda: len(session_store.entries))
+metrics.Gauge('reina_session_bytes', 'Memory held by conversation states', lambda: session_store.bytes)
+queue_depth = metrics.Gauge('reina_decode_queue_depth', 'Requests waiting for the decode batcher', lambda: decode_batcher.requests.qsize())
+
+def sentence_to_seq(sentence):
+    start = time.perf_counter()
+    seqs, read_sentences = input_vocab.encode([sentence], max_seq_len)
+    sentence_to_seq_seconds.observe(time.perf_counter() - start)
+    print("Read sentence: ", read_sentences[0])
+
+    return (seqs, read_sentences[0])
+
+def chat_session(args):
+    # The session id of a request, reset=1 starts its conversation over
+    session = args.get('session')
+    if session is not None and args.get('reset') in ('1', 'true', 'yes'):
+        session_store.reset(session)
+    return session
+
+def chat(sentence, args={}):
+    # Returns (read sentence, reply), bad decoding settings in args raise ValueError
+    sampler = make_sampler(args)
+    seq, read = sentence_to_seq(sentence)
+    return (read, reply(seq, read, sampler, chat_session(args)))
+
+def chat_iter(sentence, args={}):
+    # Like chat() but the reply is a generator of words
+    sampler = make_sampler(args)
+    seq, read = sentence_to_seq(sentence)
+    return (read, reply_iter(seq, read, sampler, chat_session(args)))
+
+def chat_batch(sentences, args={}):
+    # Returns [(read sentence, reply)] in order: all sentences are vectorized together and the
+    # ones without a cached reply are encoded once and decoded in lockstep as a single batch
+    if len(sentences) > max_bulk_size:
+        raise ValueError("At most %d sentences per batch" % max_bulk_size)
+    samplers = [make_sampler(args) for _ in sentences]
+    start = time.perf_counter()
+    seqs, reads = input_vocab.encode(sentences, max_seq_len)
+    sentence_to_seq_seconds.observe(time.perf_counter() - start)
+
+    keys = [(read,) + sampler.settings() for read, sampler in zip(reads, samplers)]
+    version = reply_cache.version
+    outs = [reply_cache.get(key) for key in keys]
+    misses = [i for i, out in enumerate(outs) if out is None]
+    chat_requests.inc(len(outs) - len(misses), labels=('cache',))
+    chat_requests.inc(len(misses), labels=('model',))
+    requests = decode_batcher.submit_many(seqs[misses], [samplers[i] for i in misses])
+    for i, request in zip(misses, requests):
+        outs[i] = "".join(w + " " for w in target_vocab.decode(request.result()))
+        reply_cache.put(keys[i], outs[i], 1 if samplers[i].is_deterministic() else None, version)
+    return list(zip(reads, outs))
+
+def cache_stats():
+    return dict(reply_cache.stats(), sessions=session_store.stats())
+
+def metrics_snapshot():
+    return metrics.snapshot()
@@ -0,0 +1,72 @@
+# In-process store of conversation state: the decoder's [h, c] after the last reply of every session
+# is kept so the next message is encoded from it instead of from zeros
+import threading
+import time
+from collections import OrderedDict
+
+class SessionStore(object):
+    def __init__(self, max_sessions=10000, ttl=1800, max_bytes=64 * 1024 * 1024):
+        # max_sessions of 0 turns sessions off, ttl is in seconds since the last turn (0 never expires)
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.bytes = 0
+        self.evictions = 0
+        self.version = None
+
+    def _drop(self, session_id):
+        entry = self.entries.pop(session_id)
+        self.bytes -= entry[1][0].nbytes + entry[1][1].nbytes
+
+    def get(self, session_id):
+        with self.lock:
+            entry = self.entries.get(session_id)
+            if entry is None:
+                return None
+            if self.ttl > 0 and time.time() - entry[0] > self.ttl:
+                self._drop(session_id)
+                self.evictions += 1
+                return None
+            self.entries.move_to_end(session_id)
+            return entry[1]
+
+    def put(self, session_id, state, version=None):
+        # version is the one read before decoding, a state of weights swapped out since is dropped
+        if self.max_sessions <= 0 or state is None:
+            return
+        with self.lock:
+            if version is not None and version != self.version:
+                return
+            if session_id in self.entries:
+                self._drop(session_id)
+            self.entries[session_id] = (time.time(), state)
+            self.bytes += state[0].nbytes + state[1].nbytes
+            # Least recently used sessions go first, by count and by memory
+            while len(self.entries) > self.max_sessions or (self.bytes > self.max_bytes and len(self.entries) > 1):
+                self._drop(next(iter(self.entries)))
+                self.evictions += 1
+
+    def reset(self, session_id):
+        with self.lock:
+            if session_id in self.entries:
+                self._drop(session_id)
+
+    def set_version(self, version):
+        # States from other model weights mean nothing to the new ones
+        with self.lock:
+            if version != self.version:
+                self.entries.clear()
+                self.bytes = 0
+                self.version = version
+
+    def stats(self):
+        with self.lock:
+            return {
+                'sessions': len(self.entries),
+                'max_sessions': self.max_sessions,
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'evictions': self.evictions
+            }
@@ -0,0 +1,158 @@
+# Decode-time shortlist for the NumPy backend: instead of the whole target vocab a decoder step
+# scores the shortlist_size most frequent target words plus, for every word of the input, the reply
+# words that most often come with it in the training pairs. bot.py writes it next to the bundle
+# when shortlist or sampled_softmax is set
+# Usage: python shortlist.py [--pairs N] [--build]
+# Reports the decode speedup and the agreement with the full softmax on up to N of the validation pairs,
+# --build first (re)writes the shortlist of the current bundle from the training files
+from __future__ import print_function
+import configparser
+import os
+import os.path
+import sys
+import time
+import numpy as np
+import bundle
+import cli
+import corpus
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+config = configparser.ConfigParser()
+config.read(os.path.join(here, 'config.ini'))
+bundle_file = config['DEFAULT'].get('bundle', 'model/bundle.json')
+# Frequent words always scored, aligned words kept per input word and training pairs counted
+shortlist_size = int(config['DEFAULT'].get('shortlist_size', 1000))
+shortlist_aligned = int(config['DEFAULT'].get('shortlist_aligned', 20))
+shortlist_pairs = int(config['DEFAULT'].get('shortlist_pairs', 50000))
+shortlist_confidence = float(config['DEFAULT'].get('shortlist_confidence', 0.1))
+# Pairs of token ids counted at once while aligning
+chunk_size = 1024
+
+def build(encoder_input_data, decoder_input_data, num_encoder_tokens, num_decoder_tokens, size, per_word):
+    # Returns {'counts', 'frequent', 'aligned'}: target word counts, the size most frequent target
+    # ids and, per input id, up to per_word other target ids by co-occurrence (-1 pads the rows)
+    counts = np.bincount(decoder_input_data.ravel(), minlength=num_decoder_tokens)
+    counts[0] = 0
+    frequent = np.argsort(-counts, kind='stable')[:size]
+
+    keys = np.zeros(0, dtype='int64')
+    key_counts = np.zeros(0, dtype='int64')
+    for i in range(0, len(encoder_input_data), chunk_size):
+        enc = encoder_input_data[i:i+chunk_size, :, None].astype('int64')
+        dec = decoder_input_data[i:i+chunk_size, None, :]
+        chunk_keys, chunk_counts = np.unique((enc * num_decoder_tokens + dec)[(enc != 0) & (dec != 0)], return_counts=True)
+        keys, inverse = np.unique(np.concatenate([keys, chunk_keys]), return_inverse=True)
+        key_counts = np.bincount(inverse, weights=np.concatenate([key_counts, chunk_counts])).astype('int64')
+
+    inputs, targets = np.divmod(keys, num_decoder_tokens)
+    # Frequent words are candidates anyway
+    keep = ~np.isin(targets, frequent)
+    inputs, targets, key_counts = inputs[keep], targets[keep], key_counts[keep]
+    order = np.lexsort((-key_counts, inputs))
+    inputs, targets = inputs[order], targets[order]
+    rank = np.arange(len(inputs)) - np.searchsorted(inputs, inputs)
+    aligned = np.full((num_encoder_tokens, per_word), -1, dtype='int32')
+    kept = rank < per_word
+    aligned[inputs[kept], rank[kept]] = targets[kept]
+    return {'counts': counts, 'frequent': frequent.astype('int32'), 'aligned': aligned}
+
+def sample_indices(count, num_pairs, rng):
+    # Sorted indices of up to num_pairs of count pairs drawn without replacement
+    return np.sort(rng.choice(count, min(count, num_pairs), replace=False))
+
+def sample_pairs(pairs, num_pairs, rng):
+    # Up to num_pairs of the pairs drawn in one pass without replacement, in their order
+    kept = []
+    for i, pair in enumerate(pairs):
+        if i < num_pairs:
+            kept.append((i, pair))
+        else:
+            j = rng.randint(0, i + 1)
+            if j < num_pairs:
+                kept[j] = (i, pair)
+    return [pair for _, pair in sorted(kept, key=lambda k: k[0])]
+
+def build_from_files(training_files, num_samples, num_pairs, input_token_index, target_token_index, max_seq_len,
+                     max_encoder_seq_length, max_decoder_seq_length, size, per_word):
+    # Counted on num_pairs drawn with data_seed from the num_samples pairs bot.py trains on
+    input_tokens = []
+    target_tokens = []
+    sampling, weights, seed = corpus.sampling_settings(config['DEFAULT'])
+    pairs = sample_pairs(corpus.training_pairs(training_files, num_samples, sampling, weights, seed),
+                         num_pairs, np.random.RandomState(seed))
+    for a, b in corpus.tokenize_pairs(pairs, max_seq_len):
+        input_tokens.append(a)
+        target_tokens.append(b)
+    return build(
+        corpus.vectorize_tokens(input_tokens, input_token_index, max_encoder_seq_length),
+        corpus.vectorize_tokens(target_tokens, target_token_index, max_decoder_seq_length),
+        len(input_token_index), len(target_token_index), size, per_word)
+
+def shortlist_path(bundle_path):
+    return os.path.splitext(bundle_path)[0] + '-shortlist.npz'
+
+def candidates(shortlist, input_seqs):
+    # Sorted target ids worth scoring for a batch of inputs
+    aligned = shortlist['aligned'][input_seqs[input_seqs != 0]].ravel()
+    return np.union1d(shortlist['frequent'], aligned[aligned >= 0]).astype('int64')
+
+def decode_seconds(engine, input_seqs, go_index, eos_index, max_len, batch_size):
+    # Time of greedy decoding every input, batch_size at a time
+    start = time.perf_counter()
+    for i in range(0, len(input_seqs), batch_size):
+        h, c = engine.encode(input_seqs[i:i+batch_size])
+        target_seq = np.full((len(h), 1), go_index, dtype='int32')
+        for _ in range(max_len):
+            probabilities, h, c = engine.step(target_seq, h, c)
+            target_seq = probabilities.argmax(axis=-1).reshape(-1, 1).astype('int32')
+            if (target_seq == eos_index).all():
+                break
+    return time.perf_counter() - start
+
+if __name__ == "__main__":
+    import numpy_lstm
+    import quantize
+    args = sys.argv[1:]
+    num_pairs = int(cli.option(args, '--pairs', 500))
+    rebuild = cli.flag(args, '--build')
+    if len(args) != 0:
+        sys.exit("Usage: python shortlist.py [--pairs N] [--build]")
+
+    model_bundle = bundle.load_bundle(bundle_file)
+    if rebuild or model_bundle.get('shortlist') is None:
+        training_files = [os.path.join(here, config['DEFAULT']['data_path'] + name)
+                          for name in config['DEFAULT']['data'].split(',')]
+        path = shortlist_path(os.path.join(bundle.here, bundle_file))
+        np.savez(path, **build_from_files(
+            training_files, int(config['DEFAULT']['num_samples']), shortlist_pairs,
+            model_bundle['input_token_index'], model_bundle['target_token_index'], model_bundle['max_seq_len'], model_bundle['max_encoder_seq_length'],
+            model_bundle['max_decoder_seq_length'], shortlist_size, shortlist_aligned))
+        bundle.update_shortlist(bundle_file, path)
+        model_bundle = bundle.load_bundle(bundle_file)
+        print("Wrote", path)
+
+    full = numpy_lstm.NumpySeq2Seq(model_bundle['numpy_weights'], num_pairs)
+    shortlisted = numpy_lstm.NumpySeq2Seq(model_bundle['numpy_weights'], num_pairs,
+                                          shortlist=model_bundle['shortlist'], shortlist_confidence=shortlist_confidence)
+    input_seqs = quantize.held_out_inputs(model_bundle, num_pairs)
+    go_index = model_bundle['target_token_index']["<GO>"]
+    eos_index = model_bundle['target_token_index']["<EOS>"]
+    max_len = model_bundle['max_seq_len']
+    token_agreement, reply_agreement, max_diff = quantize.agreement(
+        full, shortlisted, input_seqs, go_index, eos_index, max_len)
+    # Timed one request at a time like a lone user, and in batches of 16
+    for batch_size in (1, 16):
+        full_seconds = decode_seconds(full, input_seqs, go_index, eos_index, max_len, batch_size)
+        shortlisted.reset_shortlist_stats()
+        shortlisted_seconds = decode_seconds(shortlisted, input_seqs, go_index, eos_index, max_len, batch_size)
+        stats = shortlisted.shortlist_stats
+        print("Batches of %d: full softmax %.3fs, shortlist %.3fs, %.2fx faster, %.0f candidates of %d words, "
+              "%d of %d batches too large for a shortlist, %.2f%% of the other steps fell back" % (
+                  batch_size, full_seconds, shortlisted_seconds, full_seconds / max(shortlisted_seconds, 1e-9),
+                  stats['candidates'] / float(max(stats['batches'], 1)), len(model_bundle['target_vocab']),
+                  stats['full_batches'], stats['batches'], 100. * stats['fallback_rows'] / max(stats['rows'], 1)))
+    print("Held out pairs: %d" % len(input_seqs))
+    print("Top-1 agreement per token: %.2f%%" % (100 * token_agreement))
+    print("Identical greedy replies: %.2f%%" % (100 * reply_agreement))
+    print("Largest probability difference: %.5f" % max_diff)
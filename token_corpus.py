@@ -0,0 +1,175 @@
+# Binary token id corpus written once by bot.py and memory mapped by every training run after that
+# A corpus directory holds:
+#   header.json          vocabularies, sequence limits and what the corpus was built from
+#   encoder.bin          int32 token ids of every input, back to back without padding
+#   decoder.bin          same for the targets (<GO> ... <EOS>)
+#   encoder_offsets.bin  int64, pair i is encoder[offsets[i]:offsets[i+1]], one more entry than pairs
+#   decoder_offsets.bin
+# Files are opened read only so every process on the host shares the same page cache
+from io import open
+import json
+import os
+import os.path
+import numpy as np
+
+header_file = 'header.json'
+write_every = 10000
+
+def sources(paths):
+    # Rebuilt when a training file changes
+    return [[os.path.abspath(p), os.path.getsize(p), int(os.path.getmtime(p))] for p in paths]
+
+def load_header(path):
+    header = os.path.join(path, header_file)
+    if not os.path.isfile(header):
+        return None
+    with open(header, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def is_current(path, config_hash, paths):
+    header = load_header(path)
+    return header is not None and header['config_hash'] == config_hash and header['sources'] == sources(paths)
+
+def ids(tokens, token_index, seq_length):
+    unk = token_index["<UNK>"]
+    return [token_index.get(w, unk) for w in tokens[:seq_length]]
+
+def write_token_corpus(path, token_pairs, input_token_index, target_token_index, max_seq_len,
+                       max_encoder_seq_length, max_decoder_seq_length, config_hash, paths):
+    # token_pairs yields (input tokens, target tokens), it is consumed once and may be a generator
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    # The header goes last and marks the corpus complete
+    if os.path.isfile(os.path.join(path, header_file)):
+        os.remove(os.path.join(path, header_file))
+    for name in ('encoder.bin', 'decoder.bin'):
+        open(os.path.join(path, name), 'wb').close()
+    for name in ('encoder_offsets.bin', 'decoder_offsets.bin'):
+        np.zeros(1, dtype='int64').tofile(os.path.join(path, name))
+
+    header = {
+        'pairs': 0,
+        'input_vocab': sorted(input_token_index, key=input_token_index.get),
+        'target_vocab': sorted(target_token_index, key=target_token_index.get),
+        'max_seq_len': max_seq_len,
+        'max_encoder_seq_length': max_encoder_seq_length,
+        'max_decoder_seq_length': max_decoder_seq_length,
+        'config_hash': config_hash,
+        'sources': sources(paths)
+    }
+    return append_token_corpus(path, token_pairs, header)
+
+def save_header(path, header):
+    with open(os.path.join(path, header_file + '.tmp'), 'w', encoding='utf-8') as f:
+        json.dump(header, f)
+    os.replace(os.path.join(path, header_file + '.tmp'), os.path.join(path, header_file))
+
+def append_token_corpus(path, token_pairs, header=None, updates={}):
+    # Adds pairs with ids from the corpus' own vocab, the work only grows with the new pairs
+    # updates are extra header fields saved along with the new pair count
+    if header is None:
+        header = load_header(path)
+    input_token_index = dict((w, i) for i, w in enumerate(header['input_vocab']))
+    target_token_index = dict((w, i) for i, w in enumerate(header['target_vocab']))
+    max_encoder_seq_length = header['max_encoder_seq_length']
+    max_decoder_seq_length = header['max_decoder_seq_length']
+    count = header['pairs']
+
+    # Anything an interrupted append left after the last pair the header knows of is cut off
+    ends = []
+    for name, offsets_name in (('encoder.bin', 'encoder_offsets.bin'), ('decoder.bin', 'decoder_offsets.bin')):
+        offsets = np.fromfile(os.path.join(path, offsets_name), dtype='int64', count=count + 1)
+        os.truncate(os.path.join(path, offsets_name), (count + 1) * 8)
+        os.truncate(os.path.join(path, name), int(offsets[-1]) * 4)
+        ends.append(int(offsets[-1]))
+
+    files = [open(os.path.join(path, name), 'ab') for name in
+             ('encoder.bin', 'decoder.bin', 'encoder_offsets.bin', 'decoder_offsets.bin')]
+    buffers = [[], [], [], []]
+
+    def flush():
+        for f, buffer, dtype in zip(files, buffers, ('int32', 'int32', 'int64', 'int64')):
+            np.asarray(buffer, dtype=dtype).tofile(f)
+            del buffer[:]
+
+    try:
+        for input_tokens, target_tokens in token_pairs:
+            buffers[0] += ids(input_tokens, input_token_index, max_encoder_seq_length)
+            buffers[1] += ids(target_tokens, target_token_index, max_decoder_seq_length)
+            ends[0] += min(len(input_tokens), max_encoder_seq_length)
+            ends[1] += min(len(target_tokens), max_decoder_seq_length)
+            buffers[2].append(ends[0])
+            buffers[3].append(ends[1])
+            count += 1
+            if count % write_every == 0:
+                flush()
+        flush()
+    finally:
+        for f in files:
+            f.close()
+
+    header = dict(header, pairs=count, **updates)
+    save_header(path, header)
+    return header
+
+class TokenCorpus(object):
+    def __init__(self, path):
+        self.path = path
+        self.header = load_header(path)
+        if self.header is None:
+            raise ValueError("No token corpus in %s" % path)
+        self.pairs = self.header['pairs']
+        self.max_encoder_seq_length = self.header['max_encoder_seq_length']
+        self.max_decoder_seq_length = self.header['max_decoder_seq_length']
+        self.arrays = None
+
+    def __getstate__(self):
+        # Worker processes map the files again rather than receive a pickled copy of them
+        state = self.__dict__.copy()
+        state['arrays'] = None
+        return state
+
+    def _map(self):
+        if self.arrays is None:
+            self.arrays = [np.memmap(os.path.join(self.path, name), dtype=dtype, mode='r')
+                           for name, dtype in (('encoder.bin', 'int32'), ('decoder.bin', 'int32'),
+                                               ('encoder_offsets.bin', 'int64'), ('decoder_offsets.bin', 'int64'))]
+        return self.arrays
+
+    def __len__(self):
+        return self.pairs
+
+    def batch(self, start, end):
+        # Padded (encoder, decoder) id matrices of pairs start to end, the only copy made is into the padded matrix
+        encoder, decoder, encoder_offsets, decoder_offsets = self._map()
+        end = min(end, self.pairs)
+        return (self._pad(encoder, encoder_offsets, start, end, self.max_encoder_seq_length),
+                self._pad(decoder, decoder_offsets, start, end, self.max_decoder_seq_length))
+
+    def lengths(self, indices=None):
+        encoder, decoder, encoder_offsets, decoder_offsets = self._map()
+        if indices is None:
+            return (np.diff(encoder_offsets), np.diff(decoder_offsets))
+        indices = np.asarray(indices)
+        return (encoder_offsets[indices + 1] - encoder_offsets[indices],
+                decoder_offsets[indices + 1] - decoder_offsets[indices])
+
+    def take(self, indices, encoder_width, decoder_width):
+        # Padded id matrices of any set of pairs, rows longer than the width are cut
+        encoder, decoder, encoder_offsets, decoder_offsets = self._map()
+        return (self._gather(encoder, encoder_offsets, indices, encoder_width),
+                self._gather(decoder, decoder_offsets, indices, decoder_width))
+
+    def _gather(self, flat, offsets, indices, width):
+        starts = offsets[indices]
+        lengths = offsets[np.asarray(indices) + 1] - starts
+        mask = np.arange(width) < lengths[:, None]
+        data = np.zeros(shape=(len(indices), width), dtype='int32')
+        data[mask] = flat[(starts[:, None] + np.arange(width))[mask]]
+        return data
+
+    def _pad(self, flat, offsets, start, end, seq_length):
+        lengths = np.diff(offsets[start:end+1])
+        data = np.zeros(shape=(end - start, seq_length), dtype='int32')
+        data[np.arange(seq_length) < lengths[:, None]] = flat[offsets[start]:offsets[end]]
+        return data
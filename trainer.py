@@ -0,0 +1,202 @@
+# Fine-tunes the served model in its own process and publishes every run as a new weights version
+# Servers pick up the new version by watching the bundle (see reload_interval in serving.py)
+# Usage: python trainer.py            train every train_interval minutes
+#        python trainer.py once       train once
+#        python trainer.py learn      fine-tune on the conversations posted to /api/learn every learn_interval minutes
+#        python trainer.py rollback   serve the version before the current one again
+from __future__ import print_function
+from io import open
+import configparser
+import json
+import os
+import os.path
+import sys
+import time
+import numpy as np
+import bundle
+import corpus
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+config = configparser.ConfigParser()
+config.read(os.path.join(here, 'config.ini'))
+
+batch_size = int(config['DEFAULT']['batch_size'])
+num_samples = int(config['DEFAULT']['num_samples'])
+data_path = config['DEFAULT']['data_path']
+training_data = config['DEFAULT']['data'].split(',')
+streaming = config['DEFAULT'].getboolean('streaming', False)
+workers = int(config['DEFAULT'].get('workers', 1))
+bundle_file = config['DEFAULT'].get('bundle', 'model/bundle.json')
+data_sampling, data_weights, data_seed = corpus.sampling_settings(config['DEFAULT'])
+# Minutes between fine-tuning runs and epochs per run
+train_interval = float(config['DEFAULT'].get('train_interval', 60))
+train_epochs = int(config['DEFAULT'].get('train_epochs', 5))
+# Online learning: minutes between runs, new pairs needed for a run, older pairs replayed per new one and epochs per run
+learn_interval = float(config['DEFAULT'].get('learn_interval', 10))
+learn_min_pairs = int(config['DEFAULT'].get('learn_min_pairs', 32))
+replay_ratio = float(config['DEFAULT'].get('replay_ratio', 3))
+learn_epochs = int(config['DEFAULT'].get('learn_epochs', 1))
+bucket_boundaries = [int(b) for b in config['DEFAULT'].get('buckets', '').split(',') if b.strip()]
+sampled_softmax = int(config['DEFAULT'].get('sampled_softmax', 0))
+
+versions_path = os.path.join(here, 'model', 'versions')
+history_file = os.path.join(versions_path, 'history.json')
+
+def load_history():
+    if not os.path.isfile(history_file):
+        return {'current': None, 'versions': []}
+    with open(history_file, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def save_history(history):
+    with open(history_file + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(history, f, indent=1)
+    os.replace(history_file + '.tmp', history_file)
+
+def publish(history, entry):
+    bundle.update_weights(
+        bundle_file,
+        os.path.join(here, entry['weights']),
+        os.path.join(here, entry['numpy_weights']) if entry.get('numpy_weights') else None)
+    history['current'] = entry['version']
+    save_history(history)
+    print("Now serving version", entry['version'])
+
+def training_data_for(model_bundle):
+    # Vectorized against the frozen vocab of the bundle, the served model cannot grow new words
+    training_files = [os.path.join(here, data_path + file_name) for file_name in training_data]
+    max_seq_len = model_bundle['max_seq_len']
+    if streaming:
+        import data_generator
+        batches = data_generator.scan_corpus(
+            training_files, batch_size, max_seq_len, 0, num_samples, data_sampling, data_weights, data_seed)[0]
+        return data_generator.CorpusSequence(
+            batches, model_bundle['input_token_index'], model_bundle['target_token_index'],
+            model_bundle['max_encoder_seq_length'], model_bundle['max_decoder_seq_length'], max_seq_len)
+
+    input_texts = []
+    target_texts = []
+    for line_enc, line_dec in corpus.training_pairs(training_files, num_samples, data_sampling, data_weights, data_seed):
+        input_text, target_text = corpus.prepare_pair(line_enc, line_dec, max_seq_len)
+        input_texts.append(input_text)
+        target_texts.append(target_text)
+    encoder_input_data = corpus.vectorize(
+        input_texts, model_bundle['input_token_index'], model_bundle['max_encoder_seq_length'])
+    decoder_input_data = corpus.vectorize(
+        target_texts, model_bundle['target_token_index'], model_bundle['max_decoder_seq_length'])
+    return ([encoder_input_data, decoder_input_data], np.expand_dims(corpus.shift_targets(decoder_input_data), -1))
+
+def load_versions(model_bundle):
+    if not os.path.isdir(versions_path):
+        os.makedirs(versions_path)
+    history = load_history()
+    if len(history['versions']) == 0:
+        # Whatever bot.py trained becomes version 0 so there is always something to roll back to
+        history['versions'].append({
+            'version': 0,
+            'weights': os.path.relpath(model_bundle['weights'], here),
+            'numpy_weights': os.path.relpath(model_bundle['numpy_weights'], here) if model_bundle.get('numpy_weights') else None,
+            'created': os.path.getmtime(model_bundle['weights']),
+            'loss': None
+        })
+        history['current'] = 0
+    return history
+
+def served_models(model_bundle):
+    from keras import backend as K
+    import seq2seq
+
+    # Every run builds a fresh graph, drop the one from the last run
+    K.clear_session()
+    unigrams = None
+    if sampled_softmax > 0 and model_bundle.get('shortlist') is not None:
+        unigrams = (np.load(model_bundle['shortlist'])['counts'] + 1).tolist()
+    model, encoder_model, decoder_model = seq2seq.build_models(
+        len(model_bundle['input_vocab']), len(model_bundle['target_vocab']),
+        model_bundle['latent_dim'], model_bundle['embedding_dim'], sampled_softmax, unigrams)
+    model.load_weights(model_bundle['weights'])
+    return (model, encoder_model, decoder_model)
+
+def save_version(history, model, encoder_model, decoder_model, fit, source):
+    import seq2seq
+
+    version = max(v['version'] for v in history['versions']) + 1
+    weights = os.path.join(versions_path, 'bot-v%04d.h5' % version)
+    numpy_weights = os.path.join(versions_path, 'bot-v%04d.npz' % version)
+    model.save_weights(weights)
+    seq2seq.export_numpy_weights(encoder_model, decoder_model, numpy_weights)
+
+    entry = {
+        'version': version,
+        'weights': os.path.relpath(weights, here),
+        'numpy_weights': os.path.relpath(numpy_weights, here),
+        'created': time.time(),
+        'loss': float(fit.history['loss'][-1]),
+        'source': source
+    }
+    history['versions'].append(entry)
+    publish(history, entry)
+
+def train_once():
+    model_bundle = bundle.load_bundle(bundle_file)
+    history = load_versions(model_bundle)
+    model, encoder_model, decoder_model = served_models(model_bundle)
+
+    data = training_data_for(model_bundle)
+    if streaming:
+        fit = model.fit_generator(
+            data, epochs=train_epochs, workers=workers, use_multiprocessing=workers > 1, shuffle=True, verbose=2)
+    else:
+        fit = model.fit(data[0], data[1], batch_size=batch_size, epochs=train_epochs, verbose=2)
+    save_version(history, model, encoder_model, decoder_model, fit, 'corpus')
+
+def learn_once():
+    # Only the pairs recorded since the last run are vectorized, and each run trains on those plus
+    # replay_ratio older pairs apiece, so its cost follows the new data rather than the whole buffer
+    import replay_buffer
+
+    model_bundle = bundle.load_bundle(bundle_file)
+    header = replay_buffer.ingest(model_bundle)
+    fresh = header['pairs'] - header.get('trained_pairs', 0)
+    if fresh < learn_min_pairs:
+        print("%d new pairs, waiting for %d" % (fresh, learn_min_pairs))
+        return
+
+    import data_generator
+    import token_corpus
+    replay_path = os.path.join(replay_buffer.replay_path, 'corpus')
+    start = header.get('trained_pairs', 0)
+    indices = replay_buffer.mix(start, header['pairs'], replay_ratio)
+    # Without buckets every batch is still padded to its own longest pair
+    data = data_generator.BucketSequence(token_corpus.TokenCorpus(replay_path), indices, bucket_boundaries, batch_size)
+
+    history = load_versions(model_bundle)
+    model, encoder_model, decoder_model = served_models(model_bundle)
+    fit = model.fit_generator(data, epochs=learn_epochs, shuffle=False, verbose=2)
+    save_version(history, model, encoder_model, decoder_model, fit,
+                 'replay %d new, %d replayed' % (fresh, len(indices) - fresh))
+    token_corpus.save_header(replay_path, dict(header, trained_pairs=header['pairs']))
+
+def rollback():
+    history = load_history()
+    versions = [v['version'] for v in history['versions']]
+    if history['current'] not in versions or versions.index(history['current']) == 0:
+        print("No earlier version to roll back to")
+        return
+    publish(history, history['versions'][versions.index(history['current']) - 1])
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else 'schedule'
+    if command == 'rollback':
+        rollback()
+    elif command == 'once':
+        train_once()
+    elif command == 'learn':
+        while True:
+            learn_once()
+            time.sleep(learn_interval * 60)
+    else:
+        while True:
+            train_once()
+            time.sleep(train_interval * 60)
@@ -1,47 +1,75 @@
+import hashlib
 import nltk
+import os
 import os.path
 import re
-from collections import OrderedDict
-import operator
+from io import open
+
+here = os.path.dirname(__file__)
 
 special_tokens = [
     r"<[A-Z]+>",
     r"\$[a-z]+"
 ]
+special_regex = re.compile("|".join(special_tokens))
 
-special_words = [
+special_words = set([
     "lol",
     "lel",
     "lul",
     "lmao",
     "xd"
-]
+])
 
-def build_vocab(dict_words, filename=None):
-    # words will come in pairs of (word, frequency)
-    tagged = nltk.pos_tag(list(dict_words.keys()))
-    words_tagged = {}
+# POS tags of the word lists tagged so far, one file per list named after the hash of its words
+default_tag_cache = 'model/pos_tags'
+
+def tag_cache_path(tag_cache, words):
+    key = hashlib.sha1("\n".join(words).encode('utf-8')).hexdigest()
+    return os.path.join(here, tag_cache, key + '.tsv')
+
+def tag_words(words, tag_cache=default_tag_cache):
+    # nltk.pos_tag tags a word by its neighbours, so a list is always tagged in one pass
+    # and its tags are only reused for the very same list
+    if tag_cache is None:
+        return nltk.pos_tag(words)
+    path = tag_cache_path(tag_cache, words)
+    if os.path.isfile(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            tags = [line.rstrip('\n') for line in f]
+        if len(tags) == len(words):
+            return list(zip(words, tags))
+    tagged = nltk.pos_tag(words)
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        f.write("".join(tag + "\n" for _, tag in tagged))
+    os.replace(path + '.tmp', path)
+    return tagged
+
+def group_by_tag(dict_words, tagged):
+    # Words are bucketed by tag in one pass, buckets come out in tag order
+    # and words inside a bucket by descending frequency
+    buckets = {}
     for w, tag in tagged:
-        for regex in special_tokens:
-            if re.match(regex, w): tag = ".SPCL"
-        
+        if special_regex.match(w): tag = ".SPCL"
+
         # Special exceptions
         if w.lower() in special_words:
             tag = "SLANG"
 
-        if tag in list(words_tagged.keys()):
-            words_tagged[tag] += " " + w
-        else:
-            words_tagged[tag] = w
+        buckets.setdefault(tag, []).append(w)
     vocab = []
-    for tag in sorted(list(words_tagged.keys())):
-        w = words_tagged[tag].split(" ")
-        tagged_word_in_dict = {x: freq for x, freq in dict_words.items() if x in w}
-        
-        vocab += OrderedDict(sorted(tagged_word_in_dict.items(), key=operator.itemgetter(1), reverse=True)).keys()
-    # print(words_tagged)
+    for tag in sorted(buckets):
+        # sorted() is stable so words with the same frequency keep their dict order
+        vocab += sorted(buckets[tag], key=dict_words.get, reverse=True)
+    return vocab
+
+def build_vocab(dict_words, filename=None, tag_cache=default_tag_cache):
+    # words will come in pairs of (word, frequency)
+    vocab = group_by_tag(dict_words, tag_words(list(dict_words.keys()), tag_cache))
     if filename is not None:
         with open(os.path.join(os.path.dirname(__file__), filename), 'w', encoding='utf-8') as f:
             for line in vocab:
                 f.write(line + "\n")
-    return vocab
\ No newline at end of file
+    return vocab
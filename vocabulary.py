@@ -0,0 +1,49 @@
+# Compiled vocabulary: words to ids through a dict, ids to words through an array, so turning
+# sentences into ids and replies back into words costs O(tokens) whatever the vocab size
+import numpy as np
+import corpus
+
+class Vocabulary(object):
+    def __init__(self, words):
+        # words is ordered by id, like the vocab lists of the serving bundle
+        self.words = list(words)
+        self.index = dict((w, i) for i, w in enumerate(self.words))
+        self.array = np.array(self.words, dtype=object)
+        self.unk = self.index["<UNK>"]
+        # Ids that never show up in a decoded reply
+        self.hidden = np.zeros(len(self.words), dtype=bool)
+        for w in ("<PAD>", "<GO>", "<EOS>"):
+            if w in self.index:
+                self.hidden[self.index[w]] = True
+
+    @classmethod
+    def from_index(cls, token_index):
+        return cls(sorted(token_index, key=token_index.get))
+
+    def __len__(self):
+        return len(self.words)
+
+    def __getitem__(self, i):
+        return self.words[i]
+
+    def tokens(self, sentence, seq_length):
+        # Lowercased tokens cut to seq_length, words outside the vocab become <UNK>
+        return [w if w in self.index else "<UNK>"
+                for w in (t.lower() for t in corpus.tokenizer.tokenize(sentence)[:seq_length])]
+
+    def encode(self, sentences, seq_length):
+        # Returns the (len(sentences), seq_length) padded int32 ids and the read sentence of each
+        ids = np.zeros((len(sentences), seq_length), dtype='int32')
+        read_sentences = []
+        for i, sentence in enumerate(sentences):
+            tokens = self.tokens(sentence, seq_length)
+            ids[i, :len(tokens)] = [self.index[w] for w in tokens]
+            read_sentences.append("".join(w + " " for w in tokens))
+        return (ids, read_sentences)
+
+    def decode(self, ids):
+        # Words of a sequence of ids without <PAD>, <GO> and <EOS>, a 2-D array gives a list per row
+        ids = np.asarray(ids, dtype='int64')
+        if ids.ndim == 2:
+            return [self.decode(row) for row in ids]
+        return list(self.array[ids[~self.hidden[ids]]])
@@ -0,0 +1,228 @@
+# Pool of model processes for flaskapp.py, every worker imports serving.py and so holds its own model
+# Requests go to the least busy worker over its pipe and the answers come back through a queue per request
+from concurrent.futures import ThreadPoolExecutor
+import itertools
+import multiprocessing
+import zlib
+import os
+import queue
+import threading
+import time
+
+def worker_main(conn):
+    import serving
+    send_lock = threading.Lock()
+    # Several requests run at once inside a worker so its DecodeBatcher can batch them
+    executor = ThreadPoolExecutor(max_workers=serving.max_batch_size)
+
+    def send(message):
+        with send_lock:
+            conn.send(message)
+
+    def handle(kind, request_id, payload):
+        try:
+            if kind == 'chat':
+                send(('result', request_id, serving.chat(*payload)))
+            elif kind == 'batch':
+                send(('result', request_id, serving.chat_batch(*payload)))
+            elif kind == 'stream':
+                read, words = serving.chat_iter(*payload)
+                send(('token', request_id, read))
+                for w in words:
+                    send(('token', request_id, w))
+                send(('result', request_id, None))
+            elif kind == 'cache_stats':
+                send(('result', request_id, serving.cache_stats()))
+            elif kind == 'metrics':
+                send(('result', request_id, serving.metrics_snapshot()))
+            else:
+                raise ValueError("Unknown request: %s" % kind)
+        except Exception as e:
+            # Only errors that are sure to pickle go back over the pipe
+            send(('error', request_id, e if isinstance(e, ValueError) else RuntimeError(repr(e))))
+
+    send(('ready', None, os.getpid()))
+    while True:
+        try:
+            kind, request_id, payload = conn.recv()
+        except (EOFError, OSError):
+            break
+        if kind == 'stop':
+            break
+        if kind == 'ping':
+            send(('result', request_id, os.getpid()))
+        else:
+            executor.submit(handle, kind, request_id, payload)
+    executor.shutdown(wait=False)
+
+class Worker(object):
+    def __init__(self, ctx, index):
+        self.index = index
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=worker_main, args=(child_conn,), name='chat-worker-%d' % index)
+        self.process.daemon = True
+        self.process.start()
+        child_conn.close()
+
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.ready = threading.Event()
+        self.started = time.time()
+        self.reader = threading.Thread(target=self._read, name='chat-worker-%d-reader' % index)
+        self.reader.daemon = True
+        self.reader.start()
+
+    def send(self, kind, request_id, payload, replies):
+        with self.lock:
+            self.pending[request_id] = replies
+            try:
+                self.conn.send((kind, request_id, payload))
+            except (OSError, ValueError) as e:
+                del self.pending[request_id]
+                replies.put(('error', RuntimeError("Worker %d is gone: %s" % (self.index, e))))
+
+    def _read(self):
+        while True:
+            try:
+                kind, request_id, value = self.conn.recv()
+            except (EOFError, OSError):
+                break
+            if kind == 'ready':
+                self.ready.set()
+                continue
+            with self.lock:
+                replies = self.pending.get(request_id)
+                if kind != 'token':
+                    self.pending.pop(request_id, None)
+            if replies is not None:
+                replies.put((kind, value))
+        self.fail_pending(RuntimeError("Worker %d exited" % self.index))
+
+    def fail_pending(self, error):
+        with self.lock:
+            for replies in self.pending.values():
+                replies.put(('error', error))
+            self.pending.clear()
+
+    def stop(self):
+        try:
+            self.conn.send(('stop', None, None))
+        except (OSError, ValueError):
+            pass
+        self.process.join(1)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.conn.close()
+
+class WorkerPool(object):
+    def __init__(self, num_workers, timeout=60, health_interval=5, executable=None):
+        # spawn rather than fork, TensorFlow does not survive being forked
+        self.ctx = multiprocessing.get_context('spawn')
+        if executable:
+            self.ctx.set_executable(executable)
+        self.timeout = timeout
+        self.health_interval = health_interval
+        self.ids = itertools.count()
+        self.restarts = 0
+        self.lock = threading.Lock()
+        self.workers = [Worker(self.ctx, i) for i in range(num_workers)]
+        self.monitor = threading.Thread(target=self._monitor, name='chat-worker-monitor')
+        self.monitor.daemon = True
+        self.monitor.start()
+
+    def _submit(self, kind, payload, worker=None):
+        if worker is None:
+            with self.lock:
+                alive = [w for w in self.workers if w.process.is_alive()]
+                if len(alive) == 0:
+                    raise RuntimeError("No chat worker is running")
+                worker = min(alive, key=lambda w: len(w.pending))
+        replies = queue.Queue()
+        worker.send(kind, next(self.ids), payload, replies)
+        return replies
+
+    def _wait(self, replies, timeout=None):
+        try:
+            kind, value = replies.get(timeout=timeout or self.timeout)
+        except queue.Empty:
+            raise RuntimeError("Chat worker did not answer in time")
+        if kind == 'error':
+            raise value
+        return (kind, value)
+
+    def _session_worker(self, args):
+        # Every turn of a session goes to the worker holding its state
+        if args.get('session') is None:
+            return None
+        with self.lock:
+            worker = self.workers[zlib.crc32(args['session'].encode('utf-8')) % len(self.workers)]
+        return worker if worker.process.is_alive() else None
+
+    def chat(self, sentence, args={}):
+        return self._wait(self._submit('chat', (sentence, args), self._session_worker(args)))[1]
+
+    def chat_batch(self, sentences, args={}):
+        # The whole batch goes to one worker so it is decoded in lockstep
+        return self._wait(self._submit('batch', (sentences, args)))[1]
+
+    def chat_iter(self, sentence, args={}):
+        replies = self._submit('stream', (sentence, args), self._session_worker(args))
+        read = self._wait(replies)[1]
+
+        def words():
+            while True:
+                kind, value = self._wait(replies)
+                if kind == 'result':
+                    return
+                yield value
+        return (read, words())
+
+    def cache_stats(self):
+        return [self._wait(self._submit('cache_stats', None, w))[1] for w in list(self.workers)]
+
+    def metrics(self):
+        return [self._wait(self._submit('metrics', None, w))[1] for w in list(self.workers)]
+
+    def in_flight(self):
+        return sum(len(w.pending) for w in list(self.workers))
+
+    def health(self):
+        return {
+            'restarts': self.restarts,
+            'workers': [{
+                'index': w.index,
+                'pid': w.process.pid,
+                'alive': w.process.is_alive(),
+                'ready': w.ready.is_set(),
+                'in_flight': len(w.pending),
+                'uptime': time.time() - w.started
+            } for w in list(self.workers)]
+        }
+
+    def _check(self, worker):
+        if not worker.process.is_alive():
+            return False
+        if not worker.ready.is_set():
+            # Still loading its model
+            return True
+        try:
+            self._wait(self._submit('ping', None, worker), self.timeout)
+            return True
+        except RuntimeError:
+            return False
+
+    def _monitor(self):
+        while True:
+            time.sleep(self.health_interval)
+            for i, worker in enumerate(list(self.workers)):
+                if not self._check(worker):
+                    print("Restarting chat worker", i)
+                    worker.stop()
+                    worker.fail_pending(RuntimeError("Worker %d crashed" % i))
+                    with self.lock:
+                        self.workers[i] = Worker(self.ctx, i)
+                        self.restarts += 1
+
+    def close(self):
+        for worker in self.workers:
+            worker.stop()